@@ -0,0 +1,524 @@
+# -*- coding: utf8 -*-
+
+import asyncio, collections, http.client, io, ssl, time
+import urllib.parse, urllib.error
+
+from Pywemil.compression import ACCEPT_ENCODING, Decoder, content_encoding
+from Pywemil.connection_pool import split_proxy, REDIRECT_CODES
+from Pywemil.crawler import Crawler
+from Pywemil.fetcher import Fetcher, USER_AGENT, CHUNK_SIZE
+
+__author__ = "glebourgeois@me.com"
+
+class AsyncResponse:
+  """
+  A response read from a non-blocking connection.
+  Its body is read with the read coroutine, and the connection is given back
+  to the fetcher as soon as the body has been entirely read.
+  """
+
+  def __init__(self, fetcher, key, reader, writer, method, status, reason, headers, url):
+    self.fetcher = fetcher
+    self.key = key
+    self.reader = reader
+    self.writer = writer
+    self.status = status
+    self.reason = reason
+    self.headers = headers
+    self.url = url
+
+    self.chunked = "chunked" in headers.get("Transfer-Encoding", "").lower()
+    self.length = None
+    if not self.chunked and headers.get("Content-Length") is not None:
+      self.length = int( headers.get("Content-Length") )
+    if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+      self.chunked = False
+      self.length = 0
+
+    self.will_close = "close" in headers.get("Connection", "").lower() or \
+                      (self.length is None and not self.chunked)
+
+    self._chunk_left = 0
+    self._done = False
+
+  async def read(self, amt=None):
+    """
+    Reads at most amt bytes of the body, or the whole remaining body if amt is None.
+    Returns an empty bytes object once the body has been entirely read.
+    """
+    if amt is None:
+      parts = []
+      while True:
+        data = await self.read( CHUNK_SIZE )
+        if not data:
+          return b"".join( parts )
+        parts.append( data )
+
+    if self._done:
+      return b""
+
+    if self.chunked:
+      if self._chunk_left == 0:
+        line = await self.reader.readline()
+        size = int( line.split(b";")[0].strip(), 16 )
+        if size == 0:
+          # Skipping trailers
+          while line not in (b"\r\n", b"\n", b""):
+            line = await self.reader.readline()
+          self._finish()
+          return b""
+        self._chunk_left = size
+      data = await self.reader.read( min(amt, self._chunk_left) )
+      if not data:
+        raise http.client.IncompleteRead( b"" )
+      self._chunk_left -= len(data)
+      if self._chunk_left == 0:
+        await self.reader.readexactly( 2 )
+      return data
+
+    if self.length is not None:
+      if self.length == 0:
+        self._finish()
+        return b""
+      data = await self.reader.read( min(amt, self.length) )
+      if not data:
+        raise http.client.IncompleteRead( b"" )
+      self.length -= len(data)
+      if self.length == 0:
+        self._finish()
+      return data
+
+    # Body is delimited by the end of the connection
+    data = await self.reader.read( amt )
+    if not data:
+      self._finish()
+    return data
+
+  def geturl(self):
+    return self.url
+
+  def getcode(self):
+    return self.status
+
+  def close(self):
+    """
+    Closes the response. If the body has not been read entirely, the connection
+    can't be reused and is dropped.
+    """
+    if self.writer is None:
+      return
+    if not self._done:
+      self.writer.close()
+      self.writer = None
+      return
+    self._finish()
+
+  def _finish(self):
+    self._done = True
+    if self.writer is None:
+      return
+    if self.will_close:
+      self.writer.close()
+    else:
+      self.fetcher._put( self.key, self.reader, self.writer )
+    self.writer = None
+
+
+class AsyncFetcher:
+  """
+  asyncio version of Fetcher : pages are fetched on non-blocking sockets,
+  and connections are kept alive and reused between requests to a same host.
+  """
+
+  def __init__(self, proxy=None, maxsize=10, idle_timeout=30, timeout=5):
+    """
+    :param proxy: Give a proxy to use to fetch data, under the form IP:PORT (xx.xx.xx.xx:8080)
+    :param maxsize: Maximum number of idle connections kept for each (scheme, host, port, proxy)
+    :param idle_timeout: Number of seconds after which an idle connection is evicted
+    :param timeout: Timeout of connections and reads, in seconds
+    """
+    self.proxy = proxy
+    self.maxsize = maxsize
+    self.idle_timeout = idle_timeout
+    self.timeout = timeout
+
+    self.current_url = None
+    self.notfound = 0
+    self.ok = 0
+    self.skipped = 0
+
+    self.badextensions = set( ["pdf", "xls", "doc", "ppt", "rtf", "odt", "zip", "tar.gz", "tar", "exe", "jpg", "png", "jpeg", "bmp", "gif"] )
+
+    # Used by fetch(html_only=True), as in Fetcher
+    self.htmltypes = set( ["text/html", "application/xhtml+xml", "text/plain"] )
+    self.max_html_size = 10 * 1024 * 1024
+
+    self._idle = {} # key -> list of (reader, writer, last use time)
+
+  async def crawl_domain(self, domain, depth, debug=False, limit=None, visited=None, workers=8, max_parsing=None):
+    """
+    Fetches a domain, and then crawls its internal pages until given depth.
+    Pages are fetched breadth-first, workers at a time, and parsed in the loop default executor.
+    Non html contents are dropped from their headers, before their body is read (see Fetcher.is_html).
+    At most limit pages are fetched in addition to the domain page.
+    While more than max_parsing pages (2 * workers if None) are waiting to be parsed,
+    no new fetch is started (see crawler.Crawler).
+    Returns a dictionary of url -> html code.
+    """
+    if visited is None:
+      visited = set()
+    if max_parsing is None:
+      max_parsing = 2 * workers
+
+    crawler = Crawler(self, debug=debug)
+    loop = asyncio.get_running_loop()
+    pages = {}
+    key = crawler.url_key( domain )
+    base_domain = urllib.parse.urlparse( key ).netloc
+    frontier = collections.deque( [(domain, depth)] )
+    visited.add( key )
+    followed = 0
+    running = {} # task -> (stage, url, depth)
+
+    try:
+      while len(frontier) > 0 or len(running) > 0:
+        fetching = len( [1 for r in running.values() if r[0] == "fetch"] )
+        while len(frontier) > 0 and fetching < workers and len(running) - fetching < max_parsing:
+          url, d = frontier.popleft()
+          running[asyncio.ensure_future( self.fetch(url, debug, html_only=True) )] = ("fetch", url, d)
+          fetching += 1
+
+        done, _ = await asyncio.wait( list(running.keys()), return_when=asyncio.FIRST_COMPLETED )
+        for task in done:
+          stage, url, d = running.pop( task )
+
+          if stage == "fetch":
+            html = task.result()
+            if html is None:
+              if debug is True:
+                print( "Impossible to crawl %s" % url )
+              if url == domain:
+                return {}
+              continue
+
+            pages[url] = html
+            if d > 0 and (limit is None or followed < limit):
+              running[loop.run_in_executor( None, crawler.parse, html )] = ("parse", url, d)
+
+          else:
+            try:
+              links = task.result()
+            except Exception as e:
+              if debug is True:
+                print( e )
+              continue
+
+            for link in crawler.filter_links( url, base_domain, links ):
+              key = crawler.url_key( link )
+              if key in visited or (limit is not None and followed >= limit):
+                continue
+              visited.add( key )
+              frontier.append( (link, d - 1) )
+              followed += 1
+    finally:
+      for task in running:
+        task.cancel()
+
+    return pages
+
+  async def download(self, url, filename, debug=False, data=None):
+    """
+    Downloads an item via http, and
+    stores it as a file.
+    Returns the number of bytes transferred, or None if the item couldn't be downloaded.
+    """
+    u = None
+    transferred = 0
+    try:
+      u = await self._open(url, debug, data)
+      with open(filename, "wb") as f:
+        while True:
+          chunk = await asyncio.wait_for( u.read( CHUNK_SIZE ), self.timeout )
+          if not chunk:
+            break
+          f.write( chunk )
+          transferred += len(chunk)
+      u.close()
+      self.current_url = u.geturl()
+      self.ok += 1
+    except Exception as e:
+      if u is not None:
+        u.close()
+      if debug:
+        print(("Couldn't fetch %s" % url))
+        print(e)
+      self.notfound += 1
+      self.current_url = None
+      return None
+
+    return transferred
+
+  async def fetch(self, url, debug=False, data=None, html_only=False):
+    """
+    Fetches a web page.
+    If data is None, a GET request will be done, else it will be a POST request using data (must be encoded using urllib.parse.urlencode).
+    Bodies are transferred compressed when the server supports it, and decoded while read.
+    If html_only is True, responses whose Content-Type is not in htmltypes, or larger than max_html_size,
+    are dropped without reading their whole body, and None is returned.
+    """
+    u = None
+    try:
+      u = await self._open(url, debug, data, {"Accept-Encoding": ACCEPT_ENCODING})
+      if html_only and not self.is_html( u.headers, debug ):
+        u.close()
+        return self._skip( url )
+    except Exception as e:
+      if debug:
+        print(("Couldn't fetch %s" % url))
+        print(e)
+      self.notfound += 1
+      self.current_url = None
+      return None
+    try:
+      limit = self.max_html_size if html_only else None
+      l = await self._read_decoded( u, limit )
+      u.close()
+      if limit is not None and len(l) > limit:
+        return self._skip( url )
+      self.current_url = u.geturl()
+      self.ok += 1
+
+    except Exception as e:
+      u.close()
+      if debug:
+        print("Couldn't read data from socket")
+        print(e)
+      self.notfound += 1
+      self.current_url = None
+      return None
+
+    return l
+
+  async def fetch_many(self, urls, concurrency=10, debug=False):
+    """
+    Fetches several web pages, at most concurrency at a time.
+    This asynchronous generator yields (url, html) tuples as pages are fetched,
+    html being None for pages which could not be fetched.
+    """
+    urls = iter( urls )
+    running = {}
+    try:
+      while True:
+        for url in urls:
+          running[asyncio.ensure_future( self.fetch(url, debug) )] = url
+          if len(running) >= concurrency:
+            break
+
+        if len(running) == 0:
+          return
+
+        done, _ = await asyncio.wait( list(running.keys()), return_when=asyncio.FIRST_COMPLETED )
+        for task in done:
+          yield (running.pop( task ), task.result())
+    finally:
+      for task in running:
+        task.cancel()
+
+  async def close(self):
+    """
+    Closes connections kept alive by the fetcher.
+    """
+    for conns in self._idle.values():
+      for reader, writer, last in conns:
+        writer.close()
+    self._idle = {}
+
+  # Same checks as the synchronous fetcher
+  is_html = Fetcher.is_html
+
+  def get_current_url(self):
+    return self.current_url
+
+  def _skip(self, url):
+    self.skipped += 1
+    self.current_url = None
+    return None
+
+  async def _read_decoded(self, u, limit=None):
+    """
+    Reads the whole body of a response, decoding it block by block if it is compressed.
+    If limit is given, reading stops as soon as more than limit bytes have been decoded.
+    The timeout applies to each block read, so that a slow but steady transfer is not interrupted.
+    """
+    encoding = content_encoding( u.headers )
+    decoder = None
+    if encoding is not None:
+      decoder = Decoder( encoding )
+    parts = []
+    size = 0
+    while limit is None or size <= limit:
+      chunk = await asyncio.wait_for( u.read( CHUNK_SIZE ), self.timeout )
+      if not chunk:
+        if decoder is not None:
+          parts.append( decoder.flush() )
+        break
+      blocks = [chunk]
+      if decoder is not None:
+        blocks = decoder.iter_decode( chunk )
+      for block in blocks:
+        parts.append( block )
+        size += len(block)
+        if limit is not None and size > limit:
+          break
+    return b"".join( parts )
+
+  async def _open(self, url, debug=False, data=None, headers=None, max_redirects=5):
+    """
+    Sends a request, following redirections, and returns the response.
+    As Fetcher does, an urllib.error.HTTPError is raised for error status codes.
+    """
+    proxy = None
+    # Proxy is only used for http requests
+    if self.proxy != None and urllib.parse.urlsplit( url ).scheme == "http":
+      if debug:
+        print(("Using proxy %s" % self.proxy))
+      proxy = self.proxy
+
+    if isinstance(data, str):
+      data = data.encode("ascii")
+
+    method = "GET" if data is None else "POST"
+    headers = dict( headers or {} )
+    headers["User-Agent"] = USER_AGENT
+    if data is not None:
+      headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+    for i in range( max_redirects + 1 ):
+      response = await self._request(method, url, data, headers, proxy)
+      location = response.headers.get("Location")
+
+      if response.status in REDIRECT_CODES and location is not None:
+        await asyncio.wait_for( response.read(), self.timeout )
+        response.close()
+        url = urllib.parse.urljoin( url, location )
+        if response.status in (301, 302, 303):
+          method = "GET"
+          data = None
+          headers.pop("Content-Type", None)
+        continue
+
+      if response.status >= 400:
+        await asyncio.wait_for( response.read(), self.timeout )
+        response.close()
+        raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+
+      return response
+
+    raise urllib.error.HTTPError(url, response.status, "Too many redirections", response.headers, None)
+
+  async def _request(self, method, url, body, headers, proxy):
+    """
+    Sends a single request, and returns an AsyncResponse once its headers are read.
+    A reused connection closed by the server meanwhile is transparently replaced.
+    """
+    parts = urllib.parse.urlsplit( url )
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https"):
+      raise urllib.error.URLError("unknown url type: %s" % scheme)
+    port = parts.port
+    if port is None:
+      port = 443 if scheme == "https" else 80
+    if scheme != "http" or proxy is None:
+      path = parts.path or "/"
+      if parts.query:
+        path += "?" + parts.query
+    else:
+      path = urllib.parse.urlunsplit( (parts.scheme, parts.netloc, parts.path or "/", parts.query, "") )
+
+    key = (scheme, parts.hostname, port, proxy)
+
+    lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s" % parts.netloc]
+    for name, value in headers.items():
+      lines.append( "%s: %s" % (name, value) )
+    if body is not None:
+      lines.append( "Content-Length: %d" % len(body) )
+    request = ("\r\n".join( lines ) + "\r\n\r\n").encode("latin-1")
+    if body is not None:
+      request += body
+
+    while True:
+      reader, writer, reused = await self._get( key )
+      try:
+        writer.write( request )
+        await writer.drain()
+        status, reason, response_headers = await asyncio.wait_for( self._read_head(reader), self.timeout )
+      except (ConnectionError, asyncio.IncompleteReadError, http.client.RemoteDisconnected):
+        writer.close()
+        if reused:
+          continue
+        raise
+      except BaseException:
+        writer.close()
+        raise
+
+      return AsyncResponse(self, key, reader, writer, method, status, reason, response_headers, url)
+
+  async def _read_head(self, reader):
+    """
+    Reads a status line and headers, and returns them as a (status, reason, headers) tuple.
+    """
+    line = await reader.readline()
+    if not line:
+      raise http.client.RemoteDisconnected("Remote end closed connection without response")
+    parts = line.decode("latin-1").strip().split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+      raise http.client.BadStatusLine( line )
+    status = int( parts[1] )
+    reason = parts[2] if len(parts) > 2 else ""
+
+    raw = []
+    while True:
+      line = await reader.readline()
+      raw.append( line )
+      if line in (b"\r\n", b"\n", b""):
+        break
+    headers = http.client.parse_headers( io.BytesIO( b"".join(raw) ) )
+
+    if parts[0] == "HTTP/1.0" and "keep-alive" not in headers.get("Connection", "").lower():
+      headers["Connection"] = "close"
+
+    return (status, reason, headers)
+
+  async def _get(self, key):
+    """
+    Returns an idle connection for key, or opens a new one.
+    The third element of the returned tuple tells if the connection is reused.
+    """
+    now = time.time()
+    conns = self._idle.get( key, [] )
+    while len(conns) > 0:
+      reader, writer, last = conns.pop()
+      if now - last < self.idle_timeout and not reader.at_eof():
+        return (reader, writer, True)
+      writer.close()
+
+    reader, writer = await asyncio.wait_for( self._connect(key), self.timeout )
+    return (reader, writer, False)
+
+  def _put(self, key, reader, writer):
+    conns = self._idle.setdefault( key, [] )
+    if len(conns) >= self.maxsize:
+      writer.close()
+      return
+    conns.append( (reader, writer, time.time()) )
+
+  async def _connect(self, key):
+    scheme, host, port, proxy = key
+    context = ssl.create_default_context() if scheme == "https" else None
+
+    if proxy is None:
+      return await asyncio.open_connection(host, port, ssl=context)
+
+    # Only http requests are sent to the proxy (see _open)
+    proxy_host, proxy_port = split_proxy( proxy )
+    return await asyncio.open_connection(proxy_host, proxy_port)
@@ -0,0 +1,103 @@
+# -*- coding: utf8 -*-
+
+import hashlib, math
+
+__author__ = "glebourgeois@me.com"
+
+class BloomFilter:
+  """
+  Compact probabilistic set of strings : it may answer that an item has been added
+  while it has not (with a probability close to error_rate once capacity items
+  are stored), but never the contrary.
+  It can replace the set of visited urls of a crawl (see crawler.Crawler).
+  """
+
+  def __init__(self, capacity=1000000, error_rate=0.01):
+    """
+    :param capacity: Number of items the filter is sized for
+    :param error_rate: False positive rate expected when capacity items are stored
+    """
+    self.capacity = capacity
+    self.error_rate = error_rate
+
+    self.size = int( math.ceil( -capacity * math.log(error_rate) / (math.log(2) ** 2) ) )
+    self.hashes = max( 1, int( round( self.size / capacity * math.log(2) ) ) )
+    self.bits = bytearray( (self.size + 7) // 8 )
+    self.count = 0
+
+  def _positions(self, item):
+    # Double hashing : the k positions are derived from two 64 bits hashes
+    digest = hashlib.blake2b( item.encode("utf-8"), digest_size=16 ).digest()
+    h1 = int.from_bytes( digest[:8], "little" )
+    h2 = int.from_bytes( digest[8:], "little" ) | 1
+    return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+  def add(self, item):
+    """
+    Adds item, and returns True if it was not already in the filter.
+    """
+    new = False
+    for pos in self._positions( item ):
+      mask = 1 << (pos & 7)
+      if not self.bits[pos >> 3] & mask:
+        self.bits[pos >> 3] |= mask
+        new = True
+    if new:
+      self.count += 1
+    return new
+
+  def __contains__(self, item):
+    for pos in self._positions( item ):
+      if not self.bits[pos >> 3] & (1 << (pos & 7)):
+        return False
+    return True
+
+  def __len__(self):
+    return self.count
+
+
+class ScalableBloomFilter:
+  """
+  Bloom filter growing with the number of stored items : when the current filter
+  is full, a larger one with a tighter error rate is added, so that the overall
+  false positive rate stays below error_rate.
+  """
+
+  def __init__(self, initial_capacity=1000000, error_rate=0.01, growth=2, tightening=0.8):
+    """
+    :param initial_capacity: Capacity of the first filter
+    :param error_rate: Overall false positive rate
+    :param growth: Capacity ratio between two successive filters
+    :param tightening: Error rate ratio between two successive filters
+    """
+    self.initial_capacity = initial_capacity
+    self.error_rate = error_rate
+    self.growth = growth
+    self.tightening = tightening
+    self.filters = []
+    self._grow()
+
+  def _grow(self):
+    n = len(self.filters)
+    capacity = self.initial_capacity * (self.growth ** n)
+    error_rate = self.error_rate * (1 - self.tightening) * (self.tightening ** n)
+    self.filters.append( BloomFilter( capacity, error_rate ) )
+
+  def add(self, item):
+    """
+    Adds item, and returns True if it was not already in the filter.
+    """
+    if item in self:
+      return False
+    if self.filters[-1].count >= self.filters[-1].capacity:
+      self._grow()
+    return self.filters[-1].add( item )
+
+  def __contains__(self, item):
+    for f in self.filters:
+      if item in f:
+        return True
+    return False
+
+  def __len__(self):
+    return sum( [len(f) for f in self.filters] )
@@ -0,0 +1,149 @@
+# -*- coding: utf8 -*-
+
+import time, zlib
+
+__author__ = "glebourgeois@me.com"
+
+# Value of the Accept-Encoding header sent by fetchers
+ACCEPT_ENCODING = "gzip, deflate"
+
+# Size of the blocks read from the raw stream
+CHUNK_SIZE = 65536
+
+class Decoder:
+  """
+  Incremental decoder of a gzip or deflate encoded body : compressed blocks
+  are given to decode as they are received, and decoded bytes returned.
+  The size of decoded blocks may be bounded, so that a small compressed block
+  (a compression bomb) never expands in memory at once.
+  """
+
+  def __init__(self, encoding):
+    self.encoding = encoding
+    if encoding in ("gzip", "x-gzip"):
+      self._obj = zlib.decompressobj( 16 + zlib.MAX_WBITS )
+    else:
+      self._obj = zlib.decompressobj()
+    self._first = True
+    self._tail = b"" # compressed data left undecoded by the last call
+
+  def decode(self, data, max_length=0):
+    """
+    Returns the decoded bytes of data, at most max_length of them if it is not 0.
+    Compressed data left undecoded is kept, and decoded first by the next call (see pending).
+    """
+    if self._tail:
+      data = self._tail + data
+    if self._first and len(data) > 0:
+      self._first = False
+      try:
+        return self._decompress( data, max_length )
+      except zlib.error:
+        if self.encoding != "deflate":
+          raise
+        # Some servers send raw deflate data, without zlib header
+        self._obj = zlib.decompressobj( -zlib.MAX_WBITS )
+    return self._decompress( data, max_length )
+
+  def iter_decode(self, data, max_length=CHUNK_SIZE):
+    """
+    Yields the decoded bytes of data, by blocks of at most max_length bytes.
+    """
+    yield self.decode( data, max_length )
+    while self.pending:
+      yield self.decode( b"", max_length )
+
+  @property
+  def pending(self):
+    """
+    Tells if compressed data given to decode has not been entirely decoded yet.
+    """
+    return len(self._tail) > 0
+
+  def flush(self):
+    data = self._obj.flush()
+    self._tail = b""
+    return data
+
+  def _decompress(self, data, max_length):
+    data = self._obj.decompress( data, max_length )
+    self._tail = self._obj.unconsumed_tail
+    return data
+
+
+class DecodingReader:
+  """
+  File-like object wrapping a response, which decodes its body while it is read.
+  raw_bytes and decode_time tell how many bytes were received, and how long decoding took.
+  """
+
+  def __init__(self, raw, encoding):
+    self.raw = raw
+    self.decoder = Decoder( encoding )
+    self.raw_bytes = 0
+    self.decode_time = 0.0
+    self._buffer = b""
+    self._eof = False
+
+  def read(self, amt=None):
+    if amt is None:
+      parts = [self._buffer]
+      self._buffer = b""
+      while not self._eof:
+        parts.append( self._decode_chunk() )
+      return b"".join( parts )
+
+    # Blocks are joined once, rather than appended to the buffer one by one
+    parts = [self._buffer]
+    size = len(self._buffer)
+    while size < amt and not self._eof:
+      block = self._decode_chunk()
+      parts.append( block )
+      size += len(block)
+    data = b"".join( parts )
+    if size <= amt:
+      self._buffer = b""
+      return data
+    self._buffer = data[amt:]
+    return data[:amt]
+
+  def close(self):
+    self.raw.close()
+
+  def _decode_chunk(self):
+    # At most CHUNK_SIZE bytes are decoded at once, however much the data is compressed
+    start = time.perf_counter()
+    if self.decoder.pending:
+      data = self.decoder.decode( b"", CHUNK_SIZE )
+      self.decode_time += time.perf_counter() - start
+      return data
+
+    chunk = self.raw.read( CHUNK_SIZE )
+    start = time.perf_counter()
+    if not chunk:
+      self._eof = True
+      data = self.decoder.flush()
+    else:
+      self.raw_bytes += len(chunk)
+      data = self.decoder.decode( chunk, CHUNK_SIZE )
+    self.decode_time += time.perf_counter() - start
+    return data
+
+
+def content_encoding(headers):
+  """
+  Returns the content encoding given by headers if it is supported, else None.
+  """
+  encoding = (headers.get("Content-Encoding") or "").strip().lower()
+  if encoding in ("gzip", "x-gzip", "deflate"):
+    return encoding
+  return None
+
+def decoding_reader(response):
+  """
+  Returns a file-like object reading the decoded body of response.
+  """
+  encoding = content_encoding( response.headers )
+  if encoding is None:
+    return response
+  return DecodingReader( response, encoding )
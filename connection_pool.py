@@ -0,0 +1,285 @@
+# -*- coding: utf8 -*-
+
+import http.client, threading, time
+import urllib.parse, urllib.error
+
+from Pywemil.dns_cache import DNSCache
+
+__author__ = "glebourgeois@me.com"
+
+# Errors meaning that a kept-alive connection has been closed by the server
+# while it was idle in the pool.
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+REDIRECT_CODES = set( [301, 302, 303, 307, 308] )
+
+def split_proxy(proxy):
+  """
+  Splits a proxy given under the form IP:PORT (or http://IP:PORT)
+  into a (host, port) tuple.
+  """
+  if "://" not in proxy:
+    proxy = "http://" + proxy
+  parts = urllib.parse.urlsplit( proxy )
+  return (parts.hostname, parts.port or 80)
+
+
+class PooledResponse:
+  """
+  A response read from a pooled connection.
+  It behaves like the object returned by urllib.request.urlopen (read, geturl,
+  getcode, info), and gives its connection back to the pool as soon as
+  the body has been entirely read.
+  """
+
+  def __init__(self, pool, key, conn, response, url, method="GET", request_headers=None):
+    self.pool = pool
+    self.key = key
+    self.conn = conn
+    self.response = response
+    self.url = url
+    # Request this response answers (used to archive exchanges, see warc.WARCWriter)
+    self.method = method
+    self.request_headers = request_headers or {}
+
+    self.status = response.status
+    self.reason = response.reason
+    self.headers = response.msg
+
+  def read(self, amt=None):
+    data = self.response.read( amt )
+    if self.response.isclosed():
+      self._release()
+    return data
+
+  def geturl(self):
+    return self.url
+
+  def getcode(self):
+    return self.status
+
+  def info(self):
+    return self.headers
+
+  def close(self):
+    """
+    Closes the response. If the body has not been read entirely, the connection
+    can't be reused and is dropped.
+    """
+    if self.conn is None:
+      return
+    if not self.response.isclosed():
+      self.response.close()
+      self.conn.close()
+      self.conn = None
+      return
+    self._release()
+
+  def _release(self):
+    if self.conn is None:
+      return
+    if self.response.will_close:
+      self.conn.close()
+    else:
+      self.pool.put( self.key, self.conn )
+    self.conn = None
+
+
+class ConnectionPool:
+  """
+  Keeps persistent HTTP/1.1 connections, one group of connections per
+  (scheme, host, port, proxy). It can be shared by several fetchers,
+  and is thread safe.
+  """
+
+  def __init__(self, maxsize=10, idle_timeout=30, timeout=5, dns=None, metrics=None):
+    """
+    :param maxsize: Maximum number of idle connections kept for each (scheme, host, port, proxy)
+    :param idle_timeout: Number of seconds after which an idle connection is evicted
+    :param timeout: Socket timeout used by connections, in seconds
+    :param dns: DNSCache resolving hosts of new connections, a new one is built if None
+    :param metrics: Optional metrics.Metrics, receiving times to first byte (and dns and connect
+      times, through the DNSCache built if dns is None)
+    """
+    self.maxsize = maxsize
+    self.idle_timeout = idle_timeout
+    self.timeout = timeout
+    self.metrics = metrics
+    self.dns = dns
+    if self.dns is None:
+      self.dns = DNSCache( metrics=metrics )
+
+    self.created = 0
+    self.reused = 0
+
+    self._idle = {} # key -> list of (connection, last use time)
+    self._lock = threading.Lock()
+    self._evicted = time.time() # last time idle connections have been evicted
+
+  def get(self, key):
+    """
+    Returns an idle connection for key, or a new one if none is available.
+    The second element of the returned tuple tells if the connection is reused.
+    """
+    now = time.time()
+    with self._lock:
+      self._maybe_evict( now )
+      conns = self._idle.get( key, [] )
+      while len(conns) > 0:
+        conn, last = conns.pop()
+        if now - last < self.idle_timeout:
+          self.reused += 1
+          return (conn, True)
+        conn.close()
+      self.created += 1
+
+    return (self._new_connection(key), False)
+
+  def put(self, key, conn):
+    """
+    Gives a connection back to the pool.
+    """
+    now = time.time()
+    with self._lock:
+      self._maybe_evict( now )
+      conns = self._idle.setdefault( key, [] )
+      if len(conns) >= self.maxsize:
+        conn.close()
+        return
+      conns.append( (conn, now) )
+
+  def evict_idle(self):
+    """
+    Closes connections which have been idle for more than idle_timeout seconds.
+    It is also done by get and put, at most once every idle_timeout seconds.
+    """
+    with self._lock:
+      self._evict( time.time() )
+
+  def _maybe_evict(self, now):
+    # Called with the lock held : hosts which are never requested again
+    # would otherwise keep their idle sockets open
+    if now - self._evicted >= self.idle_timeout:
+      self._evict( now )
+
+  def _evict(self, now):
+    self._evicted = now
+    for key in list( self._idle.keys() ):
+      kept = []
+      for conn, last in self._idle[key]:
+        if now - last < self.idle_timeout:
+          kept.append( (conn, last) )
+        else:
+          conn.close()
+      if len(kept) > 0:
+        self._idle[key] = kept
+      else:
+        del self._idle[key]
+
+  def close(self):
+    """
+    Closes all idle connections, and stops the prefetch threads of the DNS cache.
+    """
+    with self._lock:
+      for conns in self._idle.values():
+        for conn, last in conns:
+          conn.close()
+      self._idle = {}
+    self.dns.close()
+
+  def _new_connection(self, key):
+    scheme, host, port, proxy = key
+    if proxy is not None:
+      proxy_host, proxy_port = split_proxy( proxy )
+      if scheme == "https":
+        conn = http.client.HTTPSConnection(proxy_host, proxy_port, timeout=self.timeout)
+        conn.set_tunnel(host, port)
+      else:
+        conn = http.client.HTTPConnection(proxy_host, proxy_port, timeout=self.timeout)
+    elif scheme == "https":
+      conn = http.client.HTTPSConnection(host, port, timeout=self.timeout)
+    else:
+      conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+    # Names are resolved through the cache (and TLS still checks the real host name)
+    conn._create_connection = self.dns.create_connection
+    return conn
+
+  def request(self, method, url, body=None, headers=None, proxy=None):
+    """
+    Sends a single request, without following redirections, and returns a PooledResponse.
+    A reused connection closed by the server meanwhile is transparently replaced.
+    """
+    parts = urllib.parse.urlsplit( url )
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https"):
+      raise urllib.error.URLError("unknown url type: %s" % scheme)
+    port = parts.port
+    if port is None:
+      port = 443 if scheme == "https" else 80
+    if scheme != "http" or proxy is None:
+      # Only plain http requests are sent to the proxy with an absolute url,
+      # https ones go through a tunnel
+      path = parts.path or "/"
+      if parts.query:
+        path += "?" + parts.query
+    else:
+      path = urllib.parse.urlunsplit( (parts.scheme, parts.netloc, parts.path or "/", parts.query, "") )
+
+    key = (scheme, parts.hostname, port, proxy)
+    headers = headers or {}
+
+    while True:
+      conn, reused = self.get( key )
+      try:
+        conn.request(method, path, body=body, headers=headers)
+        sent = time.perf_counter()
+        response = conn.getresponse()
+        if self.metrics is not None:
+          self.metrics.timing( "first_byte", time.perf_counter() - sent, url )
+      except STALE_ERRORS:
+        conn.close()
+        if reused:
+          continue
+        raise
+      except Exception:
+        conn.close()
+        raise
+
+      return PooledResponse(self, key, conn, response, url, method, headers)
+
+  def urlopen(self, url, data=None, headers=None, proxy=None, max_redirects=5, method=None):
+    """
+    Opens an url, following redirections.
+    If data is None, a GET request is done, else a POST one, unless method is given.
+    As urllib.request.urlopen does, an urllib.error.HTTPError is raised for error status codes.
+    """
+    if method is None:
+      method = "GET" if data is None else "POST"
+    headers = dict( headers or {} )
+    if data is not None and "Content-Type" not in headers:
+      headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+    for i in range( max_redirects + 1 ):
+      response = self.request(method, url, body=data, headers=headers, proxy=proxy)
+      location = response.headers.get("Location")
+
+      if response.status in REDIRECT_CODES and location is not None:
+        # Body of a redirection is useless, but must be read to reuse the connection
+        response.read()
+        response.close()
+        url = urllib.parse.urljoin( url, location )
+        if response.status in (301, 302, 303) and method != "HEAD":
+          method = "GET"
+          data = None
+          headers.pop("Content-Type", None)
+        continue
+
+      if response.status >= 400:
+        response.read()
+        response.close()
+        raise urllib.error.HTTPError(url, response.status, response.response.reason, response.headers, None)
+
+      return response
+
+    raise urllib.error.HTTPError(url, response.status, "Too many redirections", response.headers, None)
@@ -0,0 +1,363 @@
+# -*- coding: utf8 -*-
+
+import heapq, time, urllib.parse
+import concurrent.futures
+
+import html5lib
+
+from Pywemil import html5wrapper
+from Pywemil.frontier import Frontier
+from Pywemil.metrics import timed
+from Pywemil.parse_pool import parse_links, parse_page
+from Pywemil.retry import CircuitOpenError
+from Pywemil.sitemap import iter_sitemap
+from Pywemil.urlnorm import canonicalize_url
+
+__author__ = "glebourgeois@me.com"
+
+class Crawler:
+  """
+  Breadth-first crawl engine.
+  Urls waiting to be fetched are kept in a frontier, and fetched in parallel
+  by a bounded pool of workers. Fetched pages are handed to a separate parsing
+  stage, so that a slow page never stalls the other fetches.
+  """
+
+  def __init__(self, fetcher, workers=8, parsers=1, debug=False, canonicalize=canonicalize_url, fast_links=True, parse_pool=None, robots=None, dedup=None, follow_duplicates=True, max_parsing=None):
+    """
+    :param fetcher: Fetcher used to get pages, it is shared by all workers
+    :param workers: Number of pages fetched in parallel
+    :param parsers: Number of pages parsed in parallel
+    :param max_parsing: Maximum number of fetched pages waiting to be parsed : while parsing lags
+      behind, no new fetch is started, so that pages do not pile up in memory (2 * workers if None)
+    :param canonicalize: Function giving the form of urls compared to seen ones (None to compare raw urls).
+      Urls are still fetched and stored as they were found.
+    :param fast_links: If True, links are extracted by the html5lib tokenizer only, else from a full DOM tree
+    :param parse_pool: Optional parse_pool.ParsePool, parsing pages in worker processes instead of parsers threads
+    :param robots: Optional robots.RobotsCache : urls disallowed by robots.txt are not fetched
+    :param dedup: Optional dedup.SimHashIndex : pages whose text is a near-duplicate of an already
+      crawled page (mirrors, printer-friendly copies, session id variants) are not stored
+    :param follow_duplicates: If False, links of near-duplicate pages are not followed
+    """
+    self.fetcher = fetcher
+    self.workers = workers
+    self.parsers = parsers
+    self.debug = debug
+    self.canonicalize = canonicalize
+    self.fast_links = fast_links
+    self.parse_pool = parse_pool
+    self.robots = robots
+    self.dedup = dedup
+    self.follow_duplicates = follow_duplicates
+    self.max_parsing = max_parsing
+    if self.max_parsing is None:
+      self.max_parsing = 2 * workers
+
+  def crawl(self, domain, depth, limit=None, visited=None, frontier=None, store=None, sitemaps=False):
+    """
+    Fetches a domain, and then crawls its internal pages until given depth.
+    domain may also be a list of domains crawled together : while a host is throttled
+    by the fetcher scheduler, pages of the other hosts keep the workers busy.
+    At most limit pages are fetched in addition to the domain pages.
+
+    :param visited: Set-like object of seen urls (a bloom.BloomFilter keeps very large crawls compact).
+    :param frontier: Frontier keeping urls to fetch and seen urls, an in-memory one (using visited) is built if None.
+      A SQLiteFrontier makes the crawl resumable : given the file of a stopped crawl, it goes on where it stopped.
+    :param store: Dictionary-like object receiving url -> html code (a PageStore writes pages to disk), a dict if None.
+    :param sitemaps: If True, pages listed by the sitemaps of each domain (from its robots.txt, or /sitemap.xml)
+      are added to the frontier before the crawl starts, as links of the domain page.
+    Returns store.
+    """
+    if frontier is None:
+      frontier = Frontier( visited )
+    if store is None:
+      store = {}
+    seeds = [domain] if isinstance(domain, str) else list(domain)
+    scheduler = self.fetcher.scheduler
+    breaker = self.fetcher.breaker
+    metrics = getattr( self.fetcher, "metrics", None )
+
+    # Seeds already known by the frontier belong to a resumed crawl
+    fresh = set()
+    self._prefetched = set()
+    for seed in seeds:
+      key = self.url_key( seed )
+      if frontier.add( seed, depth, urllib.parse.urlparse( key ).netloc, key ):
+        fresh.add( seed )
+        self._prefetch( seed )
+
+    if sitemaps and depth > 0:
+      for seed in fresh:
+        self.seed_sitemaps( frontier, seed, depth - 1, limit )
+
+    fetch_pool = concurrent.futures.ThreadPoolExecutor( self.workers )
+    parse_pool = concurrent.futures.ThreadPoolExecutor( self.parsers )
+    running = {} # future -> (stage, url, depth, base domain)
+    pending = {} # url -> (html, response) of pages waiting for their fingerprint, before being stored
+    delayed = [] # heap of (time, url, depth, base domain) of failed fetches waiting to be retried
+    attempts = {} # url -> number of retries
+
+    try:
+      while len(frontier) > 0 or len(running) > 0 or len(delayed) > 0:
+        # Failed fetches whose backoff is over are queued again
+        wait = None
+        while len(delayed) > 0 and delayed[0][0] <= time.time():
+          retry_at, url, d, base = heapq.heappop( delayed )
+          frontier.requeue( url, d, base )
+        if len(delayed) > 0:
+          wait = delayed[0][0] - time.time()
+
+        # Keeping all fetch workers busy, with urls of hosts which may be fetched now,
+        # unless too many pages are waiting to be parsed
+        fetching = len( [1 for r in running.values() if r[0] == "fetch"] )
+        for host in frontier.hosts():
+          served = False
+          while fetching < self.workers and len(running) - fetching < self.max_parsing:
+            # Hosts with an open circuit are left aside until their cooldown is over
+            if breaker is not None and breaker.retry_in( host ) > 0:
+              delay = breaker.retry_in( host )
+              if wait is None or delay < wait:
+                wait = delay
+              break
+            if scheduler is not None and not scheduler.acquire( host, block=False ):
+              delay = scheduler.ready_in( host )
+              if delay is not None and (wait is None or delay < wait):
+                wait = delay
+              break
+            entry = frontier.pop( host )
+            if entry is None:
+              if scheduler is not None:
+                scheduler.release( host )
+              break
+            url, d, base = entry
+            running[fetch_pool.submit( self._fetch, url )] = ("fetch", url, d, base)
+            fetching += 1
+            served = True
+
+          if served:
+            # Other hosts come first on next round
+            frontier.rotate( host )
+
+        if metrics is not None:
+          metrics.gauge( "frontier", len(frontier) )
+          metrics.gauge( "fetching", fetching )
+          metrics.gauge( "parsing", len(running) - fetching )
+          metrics.gauge( "delayed", len(delayed) )
+          metrics.maybe_report()
+
+        if len(running) == 0:
+          # Every host is throttled
+          time.sleep( wait if wait is not None else 0.1 )
+          continue
+
+        done, _ = concurrent.futures.wait( list(running.keys()), timeout=wait, return_when=concurrent.futures.FIRST_COMPLETED )
+        for future in done:
+          stage, url, d, base = running.pop( future )
+
+          if stage == "fetch":
+            html, error, response = future.result()
+            if html is None and isinstance(error, CircuitOpenError):
+              heapq.heappush( delayed, (time.time() + error.retry_in, url, d, base) )
+              continue
+            if html is None and self._should_retry( url, error, attempts ):
+              heapq.heappush( delayed, (time.time() + self.fetcher.retry.delay( attempts[url] - 1, error ), url, d, base) )
+              continue
+            attempts.pop( url, None )
+
+            if html is None:
+              if self.debug is True:
+                print( "Impossible to crawl %s" % url )
+              frontier.done( url )
+              if len(seeds) == 1 and url in fresh:
+                return store
+              continue
+
+            if self.dedup is not None:
+              # The page is stored once its fingerprint tells it is not a near-duplicate
+              pending[url] = (html, response)
+              running[self._submit_parse( parse_pool, html )] = ("parse", url, d, base)
+              continue
+
+            self._store( store, url, html, response )
+            if d > 0 and (limit is None or frontier.followed < limit):
+              running[self._submit_parse( parse_pool, html )] = ("parse", url, d, base)
+            else:
+              frontier.done( url )
+
+          else:
+            frontier.done( url )
+            try:
+              links, seconds = future.result()
+              if metrics is not None:
+                metrics.timing( "parse", seconds, url )
+            except Exception as e:
+              if self.debug is True:
+                print( e )
+              if url in pending:
+                self._store( store, url, *pending.pop( url ) )
+              continue
+
+            if self.dedup is not None:
+              links, fingerprint = links
+              html, response = pending.pop( url )
+              original = None
+              if fingerprint is not None:
+                original = self.dedup.add( fingerprint, url )
+              if original is None:
+                self._store( store, url, html, response )
+              else:
+                if self.debug is True:
+                  print( "%s is a near-duplicate of %s" % (url, original) )
+                if not self.follow_duplicates:
+                  continue
+              if d <= 0 or (limit is not None and frontier.followed >= limit):
+                continue
+
+            for link in self.filter_links( url, base, links ):
+              if limit is not None and frontier.followed >= limit:
+                break
+              if frontier.add( link, d - 1, base, self.url_key( link ) ):
+                frontier.followed += 1
+                self._prefetch( link )
+    finally:
+      fetch_pool.shutdown( wait=False, cancel_futures=True )
+      parse_pool.shutdown( wait=False, cancel_futures=True )
+      frontier.checkpoint()
+
+    return store
+
+  def parse(self, html):
+    """
+    Parses a page, and returns the list of links it contains.
+    """
+    if self.fast_links:
+      return html5wrapper.extract_links( html, base=True )
+    parser = html5lib.HTMLParser(tree=html5lib.treebuilders.getTreeBuilder("dom"))
+    dom = parser.parse( html )
+    return list( html5wrapper.extract_doc_links( dom ).keys() )
+
+  def url_key(self, url):
+    """
+    Returns the form of url compared to seen ones : its canonical form, unless canonicalize is None.
+    """
+    if self.canonicalize is None:
+      return url
+    return self.canonicalize( url )
+
+  def filter_links(self, url, base_domain, links):
+    """
+    Resolves links found in the page url, and keeps only the internal ones
+    (whose canonical host is base_domain), which do not point to a file with a bad extension.
+    Other non html contents are dropped by the fetcher from their headers (see fetcher.Fetcher.is_html).
+    """
+    ret = []
+    for key in links:
+      # We do not want anchors to be crawled
+      if len(key) < 1 or key[0] == '#':
+        continue
+
+      try:
+        link = urllib.parse.urldefrag( urllib.parse.urljoin(url, key) )[0]
+        netloc = urllib.parse.urlparse( self.url_key( link ) ).netloc
+      except ValueError:
+        # Malformed link (invalid port or IPv6 address)
+        continue
+
+      # Trying to get eventual file extension, and to check its validity
+      parts = link.split(".")
+      ext = parts[ len(parts) - 1].strip().lower()
+      if ext in self.fetcher.badextensions:
+        continue
+
+      # Let's check if it's an internal link, and not an outgoing one
+      if base_domain == netloc:
+        ret.append( link )
+
+    return ret
+
+  def seed_sitemaps(self, frontier, domain, depth, limit=None):
+    """
+    Streams internal pages listed by the sitemaps of domain into the frontier.
+    """
+    base = urllib.parse.urlparse( self.url_key( domain ) ).netloc
+    if self.robots is not None:
+      locations = self.robots.sitemaps( domain )
+    else:
+      locations = []
+    if len(locations) == 0:
+      locations = [urllib.parse.urljoin( domain, "/sitemap.xml" )]
+
+    for location in locations:
+      for url in iter_sitemap( self.fetcher, location, debug=self.debug ):
+        if limit is not None and frontier.followed >= limit:
+          return
+        for link in self.filter_links( domain, base, [url] ):
+          if frontier.add( link, depth, base, self.url_key( link ) ):
+            frontier.followed += 1
+
+  def _prefetch(self, url):
+    """
+    Resolves in advance the host of an url queued in the frontier.
+    """
+    dns = getattr( getattr( self.fetcher, "pool", None ), "dns", None )
+    if dns is None:
+      return
+    try:
+      parts = urllib.parse.urlsplit( url )
+      port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+      # Malformed url : its fetch will fail anyway
+      return
+    if parts.hostname in self._prefetched:
+      return
+    self._prefetched.add( parts.hostname )
+    if self.fetcher.proxy is None:
+      dns.prefetch( parts.hostname, port )
+
+  def _submit_parse(self, executor, html):
+    """
+    Hands html to the parse stage, in executor threads or in the parse pool processes.
+    The future gives (links, parse time), links being (links, fingerprint) when dedup is on.
+    """
+    if self.dedup is not None:
+      function, args = parse_page, (html, self.fast_links, self.dedup.bits)
+    elif self.parse_pool is not None:
+      function, args = parse_links, (html, self.fast_links)
+    else:
+      function, args = self.parse, (html,)
+    if self.parse_pool is not None:
+      return self.parse_pool.submit( timed, function, *args )
+    return executor.submit( timed, function, *args )
+
+  def _store(self, store, url, html, response):
+    # A warc.WARCWriter also archives the headers of the exchange
+    if response is not None and hasattr(store, "write_response"):
+      store.write_response( url, html, response )
+    else:
+      store[url] = html
+
+  def _should_retry(self, url, error, attempts):
+    """
+    Tells if a failed fetch of url should be retried later, and counts the retry.
+    """
+    retry = self.fetcher.retry
+    attempt = attempts.get( url, 0 )
+    if retry is None or error is None or attempt >= retry.retries or not retry.is_retryable( error ):
+      return False
+    attempts[url] = attempt + 1
+    return True
+
+  def _fetch(self, url):
+    """
+    Fetches url in a worker, and returns a (html, error, response) tuple.
+    Retries are not done here, but scheduled by the crawl loop, so that a worker
+    never sleeps while other hosts are waiting.
+    """
+    # The scheduler slot, if any, has been acquired when the url left the frontier
+    with self.fetcher.throttle( url, acquired=True ):
+      if self.robots is not None and not self.robots.can_fetch( url ):
+        if self.debug is True:
+          print( "%s is disallowed by robots.txt" % url )
+        return (None, None, None)
+      html = self.fetcher.fetch( url, self.debug, html_only=True, retry=False )
+      return (html, self.fetcher.get_last_error(), self.fetcher.get_last_response())
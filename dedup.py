@@ -0,0 +1,116 @@
+# -*- coding: utf8 -*-
+
+import hashlib, re
+
+__author__ = "glebourgeois@me.com"
+
+__words = re.compile( r"\w+", re.UNICODE )
+
+def shingles(text, size=3):
+  """
+  Yields the overlapping sequences of size words of text (lower cased).
+  A text shorter than size words gives a single shingle.
+  """
+  words = __words.findall( text.lower() )
+  if len(words) <= size:
+    if len(words) > 0:
+      yield " ".join( words )
+    return
+  for i in range( len(words) - size + 1 ):
+    yield " ".join( words[i:i + size] )
+
+def _hash(shingle, bits):
+  return int.from_bytes( hashlib.blake2b( shingle.encode("utf-8"), digest_size=bits // 8 ).digest(), "big" )
+
+def simhash(text, bits=64, size=3):
+  """
+  Returns the SimHash fingerprint of text, an integer of bits bits : texts sharing
+  most of their shingles get fingerprints differing by a few bits only.
+  Returns None for a text without any word.
+  """
+  weights = [0] * bits
+  empty = True
+  for shingle in shingles( text, size ):
+    empty = False
+    h = _hash( shingle, bits )
+    for i in range( bits ):
+      if (h >> i) & 1:
+        weights[i] += 1
+      else:
+        weights[i] -= 1
+  if empty:
+    return None
+
+  fingerprint = 0
+  for i in range( bits ):
+    if weights[i] > 0:
+      fingerprint |= 1 << i
+  return fingerprint
+
+def hamming(a, b):
+  """
+  Returns the number of bits differing between fingerprints a and b.
+  """
+  return bin( a ^ b ).count("1")
+
+
+class SimHashIndex:
+  """
+  Index of SimHash fingerprints, answering "is there a fingerprint at most distance
+  bits away from this one ?" without scanning all of them.
+  Fingerprints are cut into distance + 1 blocks : two fingerprints close enough
+  share at least one identical block, so only fingerprints sharing a block are compared.
+  """
+
+  def __init__(self, distance=3, bits=64):
+    """
+    :param distance: Maximum Hamming distance between near-duplicate fingerprints
+    :param bits: Size of fingerprints (see simhash)
+    """
+    self.distance = distance
+    self.bits = bits
+    self.duplicates = 0
+
+    blocks = distance + 1
+    self._blocks = [] # (shift, mask) of each block
+    start = 0
+    for i in range( blocks ):
+      size = bits // blocks + (1 if i < bits % blocks else 0)
+      self._blocks.append( (start, (1 << size) - 1) )
+      start += size
+    self._tables = [{} for b in self._blocks] # block value -> list of fingerprints
+    self._keys = {} # fingerprint -> key of the first item having it
+
+  def find(self, fingerprint):
+    """
+    Returns the key of an indexed near-duplicate of fingerprint, or None.
+    """
+    if fingerprint in self._keys:
+      return self._keys[fingerprint]
+    for (shift, mask), table in zip( self._blocks, self._tables ):
+      for candidate in table.get( (fingerprint >> shift) & mask, () ):
+        if hamming( fingerprint, candidate ) <= self.distance:
+          return self._keys[candidate]
+    return None
+
+  def add(self, fingerprint, key):
+    """
+    Indexes fingerprint of item key (an url for instance, not None), unless it is
+    a near-duplicate of an indexed one.
+    Returns the key of the near-duplicate found, or None if fingerprint has been added.
+    """
+    original = self.find( fingerprint )
+    if original is not None:
+      self.duplicates += 1
+      return original
+
+    self._keys[fingerprint] = key
+    for (shift, mask), table in zip( self._blocks, self._tables ):
+      table.setdefault( (fingerprint >> shift) & mask, [] ).append( fingerprint )
+    return None
+
+  def __contains__(self, fingerprint):
+    return self.find( fingerprint ) is not None
+
+  def __len__(self):
+    return len( self._keys )
@@ -0,0 +1,125 @@
+# -*- coding: utf8 -*-
+
+import concurrent.futures, socket, threading, time
+
+__author__ = "glebourgeois@me.com"
+
+class DNSCache:
+  """
+  In-process cache of host name resolutions, used by ConnectionPool to open connections.
+  Successful resolutions are kept ttl seconds, failures negative_ttl seconds.
+  Hosts about to be fetched can be resolved in advance with prefetch.
+  """
+
+  def __init__(self, ttl=300, negative_ttl=30, resolver=socket.getaddrinfo, prefetch_workers=4, metrics=None):
+    """
+    :param ttl: Number of seconds a resolution is kept
+    :param negative_ttl: Number of seconds a failed resolution is kept
+    :param resolver: Function resolving names, with socket.getaddrinfo signature (may be replaced by a stub)
+    :param prefetch_workers: Number of threads resolving prefetched hosts
+    :param metrics: Optional metrics.Metrics, receiving resolution ("dns") and connection ("connect") times
+    """
+    self.ttl = ttl
+    self.negative_ttl = negative_ttl
+    self.resolver = resolver
+    self.prefetch_workers = prefetch_workers
+    self.metrics = metrics
+
+    self.hits = 0
+    self.misses = 0
+    self.failures = 0
+
+    self._entries = {} # (host, port) -> (addresses or exception, expiration time)
+    self._lock = threading.Lock()
+    self._executor = None
+
+  def resolve(self, host, port):
+    """
+    Returns the list of (family, type, proto, canonname, sockaddr) tuples of host,
+    as socket.getaddrinfo does. Raises socket.gaierror if host can't be resolved.
+    """
+    key = (host, port)
+    now = time.time()
+    with self._lock:
+      entry = self._entries.get( key )
+      if entry is not None and entry[1] > now:
+        self.hits += 1
+        if isinstance(entry[0], Exception):
+          # A new exception each time, so that tracebacks do not pile up on the cached one
+          raise socket.gaierror( *entry[0].args )
+        return entry[0]
+      self.misses += 1
+
+    start = time.perf_counter()
+    try:
+      addresses = self.resolver( host, port, 0, socket.SOCK_STREAM )
+    except socket.gaierror as e:
+      with self._lock:
+        self.failures += 1
+        self._entries[key] = (socket.gaierror( *e.args ), time.time() + self.negative_ttl)
+      raise
+    finally:
+      if self.metrics is not None:
+        self.metrics.timing( "dns", time.perf_counter() - start )
+
+    with self._lock:
+      self._entries[key] = (addresses, time.time() + self.ttl)
+    return addresses
+
+  def prefetch(self, host, port):
+    """
+    Resolves host in background, unless its resolution is already cached.
+    """
+    with self._lock:
+      entry = self._entries.get( (host, port) )
+      if entry is not None and entry[1] > time.time():
+        return
+      if self._executor is None:
+        self._executor = concurrent.futures.ThreadPoolExecutor( self.prefetch_workers )
+    self._executor.submit( self._prefetch, host, port )
+
+  def create_connection(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """
+    Same as socket.create_connection, but resolving the host through the cache.
+    """
+    host, port = address
+    error = None
+    for family, socktype, proto, canonname, sockaddr in self.resolve( host, port ):
+      sock = None
+      try:
+        sock = socket.socket( family, socktype, proto )
+        if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+          sock.settimeout( timeout )
+        if source_address:
+          sock.bind( source_address )
+        start = time.perf_counter()
+        sock.connect( sockaddr )
+        if self.metrics is not None:
+          self.metrics.timing( "connect", time.perf_counter() - start )
+        return sock
+      except OSError as e:
+        error = e
+        if sock is not None:
+          sock.close()
+
+    if error is not None:
+      raise error
+    raise OSError("getaddrinfo returns an empty list")
+
+  def clear(self):
+    with self._lock:
+      self._entries = {}
+
+  def close(self):
+    """
+    Stops prefetch threads (they are started again by the next prefetch).
+    """
+    if self._executor is not None:
+      self._executor.shutdown( wait=False )
+      self._executor = None
+
+  def _prefetch(self, host, port):
+    try:
+      self.resolve( host, port )
+    except socket.gaierror:
+      pass
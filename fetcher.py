@@ -2,171 +2,421 @@
 
 import urllib.request, urllib.error, urllib.parse
 import re, html.parser, socket, sys
+import contextlib, os, threading, time
 
-import html5lib
-import html5lib.treewalkers
-import html5lib.serializer
-
-from Pywemil import html5wrapper
+from Pywemil.compression import ACCEPT_ENCODING, content_encoding, decoding_reader
+from Pywemil.connection_pool import ConnectionPool
+from Pywemil.proxy_pool import ProxyPool, is_proxy_failure
+from Pywemil.crawler import Crawler
+from Pywemil.retry import CircuitOpenError, is_host_failure
 
 # defines a timeout to stop trying to reach a server
 socket.setdefaulttimeout( 5 )
 
 __author__ = "glebourgeois@me.com"
 
+USER_AGENT = "Mozilla/5.0 (X11; U; Linux x86_64; en-US; rv:1.7.6) Gecko/20050512 Firefox"
+
+# Size of the blocks read from the network when a body is streamed
+CHUNK_SIZE = 65536
+
 class Fetcher:
   """
   This module can be used to fetch web pages.
   It's able to handle a proxy, and uses a Firefox User Agent.
+  Connections are kept alive and reused between requests to a same host.
   """
   
-  def __init__(self, proxy=None):
+  def __init__(self, proxy=None, pool=None, cache=None, scheduler=None, retry=None, breaker=None, metrics=None):
     """
-    :param proxy: Give a proxy to use to fetch data, under the form IP:PORT (xx.xx.xx.xx:8080)
+    :param proxy: Give a proxy to use to fetch data, under the form IP:PORT (xx.xx.xx.xx:8080),
+      or a ProxyPool spreading requests (http and https) on a fleet of proxies.
+    :param pool: ConnectionPool to use, it may be shared between several fetchers. A new one is built if None.
+    :param cache: Optional HTTPCache, used to revalidate already fetched pages instead of fetching them again.
+    :param scheduler: Optional HostScheduler, enforcing per host request rates and concurrency.
+    :param retry: Optional RetryPolicy : failed requests are retried with exponential backoff.
+    :param breaker: Optional CircuitBreaker : failing hosts are not requested anymore for a while.
+    :param metrics: Optional Metrics, receiving timings of each stage of requests, bytes and status codes.
+      It is given to the pool built if pool is None (a shared pool takes its own metrics).
     """
     self.proxy = proxy
+    self.cache = cache
+    self.scheduler = scheduler
+    self.retry = retry
+    self.breaker = breaker
+    self.metrics = metrics
+    self.pool = pool
+    if self.pool is None:
+      self.pool = ConnectionPool( metrics=metrics )
 
     self.current_url = None
     self.notfound = 0
     self.ok = 0
 
+    self.skipped = 0
+    # Counters and current_url are updated by the workers of a crawl
+    self._lock = threading.Lock()
+    # Last error of each thread, see get_last_error
+    self._local = threading.local()
+
     self.badextensions = set( ["pdf", "xls", "doc", "ppt", "rtf", "odt", "zip", "tar.gz", "tar", "exe", "jpg", "png", "jpeg", "bmp", "gif"] )
+
+    # Used by fetch(html_only=True) : accepted content types, maximum size of a page (None for no limit),
+    # and whether headers are first checked with a HEAD request
+    self.htmltypes = set( ["text/html", "application/xhtml+xml", "text/plain"] )
+    self.max_html_size = 10 * 1024 * 1024
+    self.head_check = False
  
-  def crawl_domain(self, domain, depth, debug=False, limit=None, visited=set()):
+  def crawl_domain(self, domain, depth, debug=False, limit=None, visited=None, workers=8, frontier=None, store=None, parse_pool=None, robots=None, sitemaps=False, dedup=None, follow_duplicates=True):
     """
     Fetches a domain, and then crawls its internal pages until given depth.
-    Returns a dictionary of url -> html code.
+    Pages are fetched breadth-first, workers at a time (see crawler.Crawler).
+    domain may also be a list of domains, crawled together.
+    Returns a dictionary of url -> html code, or store if given (see crawler.Crawler.crawl for frontier and store).
+    With a parse_pool.ParsePool, pages are parsed by its worker processes.
+    With a robots.RobotsCache, pages disallowed by robots.txt are not fetched.
+    If sitemaps is True, the frontier is first seeded with pages listed by the domain sitemaps.
+    With a dedup.SimHashIndex, near-duplicate pages are not stored, and their links are not
+    followed if follow_duplicates is False.
     """
-    pages = {}
-    base_domain = urllib.parse.urlparse( domain ).netloc
-    
-    html = self.fetch( domain, debug)
-    if html is not None:
-      pages[domain] = html
-      visited.add( domain )
-
-    else:
-      if debug is True:
-        print( "Impossible to crawl %s" % domain )
-      return {}
-
-    if depth > 0 and (limit is None or limit > 0):
-      dom = None      
-      parser = html5lib.HTMLParser(tree=html5lib.treebuilders.getTreeBuilder("dom"))
-      
-      try:
-        dom = parser.parse( html )
-      except Exception as e:
-        if debug is True:
-          print( e )
-        return {}
-      
-      links = html5wrapper.extract_doc_links( dom )
-      for key in links:
-        # We do not want anchors to be crawled
-        if len(key) < 1 or key[0] == '#':
-          continue
-        
-        url = urllib.parse.urljoin(domain, key)
-        
-        # Trying to get eventual file extension, and to check its validity
-        parts = url.split(".")
-        ext = parts[ len(parts) - 1].strip().lower()
-        if ext in self.badextensions:
-          continue
-        
-        # Let's check if it's an internal link, and not an outgoing one
-        if base_domain == urllib.parse.urlparse( url ).netloc and \
-           url not in visited and (limit is None or limit > 0):
-             visited.add( url )
-             pages.update( self.crawl_domain(url, depth - 1, debug, limit, visited) )
-        
-             if limit is not None:
-               limit -= 1
-
-    return pages
+    crawler = Crawler(self, workers=workers, debug=debug, parse_pool=parse_pool, robots=robots, dedup=dedup, follow_duplicates=follow_duplicates)
+    return crawler.crawl(domain, depth, limit, visited, frontier, store, sitemaps)
 
   
-  def download(self, url, filename, debug=False, data=None):
+  def download(self, url, filename, debug=False, data=None, resume=False, max_bytes=None, timeout=None, progress=None):
     """
     Downloads an item via http, and
-    stores it as a file.
+    stores it as a file. The body is written chunk by chunk, so memory use does not depend on its size.
+    Returns the number of bytes transferred, or None if the item couldn't be downloaded.
+
+    :param resume: If True and filename already exists, only its missing part is requested (HTTP Range).
+    :param max_bytes: The download is aborted if the item is larger than max_bytes.
+    :param timeout: The download is aborted if it lasts more than timeout seconds.
+    :param progress: Optional function called after each chunk with (bytes transferred, expected total size or None).
     """
+    self._local.error = None
+    with self.throttle( url ):
+      return self._download(url, filename, debug, data, resume, max_bytes, timeout, progress)
+
+  def _download(self, url, filename, debug=False, data=None, resume=False, max_bytes=None, timeout=None, progress=None):
     u = None
-    opener = None
-    request = None
+    start = time.time()
+    transferred = 0
+    offset = 0
+    headers = {}
+    if resume and data is None and os.path.exists( filename ):
+      offset = os.path.getsize( filename )
+      if offset > 0:
+        headers["Range"] = "bytes=%d-" % offset
+
     try:
-      # Building opener
-      if self.proxy != None:
+      try:
+        u = self._open(url, debug, data, headers)
+      except urllib.error.HTTPError as e:
+        if e.code != 416 or offset == 0:
+          raise
+        # Range not satisfiable : the file is already complete if it has the size of the item
+        m = re.match( r"bytes\s+\*/(\d+)", (e.headers or {}).get("Content-Range", "") )
+        if m is not None and int( m.group(1) ) == offset:
+          return 0
+        # Else the partial file is larger than the item, or bad : it is downloaded again
         if debug:
-          print(("Using proxy %s" % self.proxy))
-        proxy= urllib.request.ProxyHandler({'http': self.proxy})
-        opener = urllib.request.build_opener(proxy)
+          print(("Restarting download of %s" % url))
+        del headers["Range"]
+        u = self._open(url, debug, data, headers)
+
+      mode = "wb"
+      if u.status == 206 and offset > 0:
+        m = re.match( r"bytes\s+(\d+)-", u.headers.get("Content-Range", "") )
+        if m is None or int( m.group(1) ) != offset:
+          raise IOError("Unexpected Content-Range: %s" % u.headers.get("Content-Range"))
+        mode = "ab"
       else:
-        opener = urllib.request.build_opener()
+        # Range ignored by the server, all the item is sent again
+        offset = 0
+
+      total = None
+      if u.headers.get("Content-Length") is not None:
+        total = offset + int( u.headers.get("Content-Length") )
+        if max_bytes is not None and total > max_bytes:
+          raise IOError("Item is too large (%d bytes)" % total)
 
-      # Building request      
-      request = urllib.request.urlretrieve(url, filename, data=data)
+      with open(filename, mode) as f:
+        while True:
+          chunk = u.read( CHUNK_SIZE )
+          if not chunk:
+            break
+          f.write( chunk )
+          transferred += len(chunk)
+
+          if max_bytes is not None and offset + transferred > max_bytes:
+            raise IOError("Item is too large (more than %d bytes)" % max_bytes)
+          if timeout is not None and time.time() - start > timeout:
+            raise IOError("Download lasts more than %d seconds" % timeout)
+          if progress is not None:
+            progress( offset + transferred, total )
+      u.close()
+      self._succeeded( u.geturl() )
+      if self.metrics is not None:
+        self.metrics.count( "bytes", transferred, url )
     except Exception as e:
+      self._local.error = e
+      if u is not None:
+        u.close()
       if debug:        
         print(("Couldn't fetch %s" % url))
         print(e)
-      self.notfound += 1
-      self.current_url = None
+      self._failed()
       return None
     
-    return True 
+    return transferred
 
   
-  def fetch(self, url, debug=False, data=None):
+  def fetch(self, url, debug=False, data=None, html_only=False, retry=True):
     """
     Fetches a web page.
     If data is None, a GET request will be done, else it will be a POST request using data (must be encoded using urllib.parse.urlencode).
+    With a cache, GET requests are conditional, and a 304 answer is served from the cache.
+    Bodies are transferred compressed when the server supports it, and decoded while read.
+    If html_only is True, responses whose Content-Type is not in htmltypes, or larger than max_html_size,
+    are dropped before their body is read (see is_html), and None is returned.
+    If retry is False, the retry policy is not applied (the caller retries by itself, see get_last_error).
     """
+    self._local.error = None
+    self._local.response = None
+    with self.throttle( url ):
+      return self._fetch(url, debug, data, html_only, retry)
+
+  def _fetch(self, url, debug=False, data=None, html_only=False, retry=True):
     u = None
-    opener = None
-    request = None
+    headers = {"Accept-Encoding": ACCEPT_ENCODING}
+    if self.cache is not None and data is None:
+      headers.update( self.cache.conditional_headers( url ) )
     try:
-      # Building opener
-      if self.proxy != None:
-        if debug:
-          print(("Using proxy %s" % self.proxy))
-        proxy= urllib.request.ProxyHandler({'http': self.proxy})
-        opener = urllib.request.build_opener(proxy)
-        #urllib2.install_opener(opener)
-        #urllib2.urlopen('http://www.google.com')
-      else:
-        opener = urllib.request.build_opener()
+      if html_only and self.head_check and data is None:
+        h = self._open(url, debug, None, method="HEAD", retry=retry)
+        h.read()
+        h.close()
+        if not self.is_html( h.headers, debug ):
+          return self._skip( url )
 
-      # Building request
-      request = urllib.request.Request(url)
-      request.add_header("User-Agent", "Mozilla/5.0 (X11; U; Linux x86_64; en-US; rv:1.7.6) Gecko/20050512 Firefox")
-      request.add_data(data)
+      u = self._open(url, debug, data, headers, retry=retry)
+      if u.status == 304:
+        # Reading the (empty) body gives the connection back to the pool
+        u.read()
+        u.close()
+        l = self.cache.load( url )
+        if l is not None:
+          self._succeeded( u.geturl() )
+          return l
+        # Cached body is lost, let's fetch it again
+        u = self._open(url, debug, data, {"Accept-Encoding": ACCEPT_ENCODING}, retry=retry)
 
-      # Opening URL
-      u = opener.open(request)
+      if html_only and not self.is_html( u.headers, debug ):
+        u.close()
+        return self._skip( url )
     except Exception as e:
+      self._local.error = e
       if debug:        
         print(("Couldn't fetch %s" % url))
         print(e)
-      self.notfound += 1
-      self.current_url = None
+      self._failed()
       return None
     try:
-      l = u.read()
-      self.current_url = u.geturl()
+      start = time.perf_counter()
+      reader = decoding_reader( u )
+      if html_only and self.max_html_size is not None:
+        l = reader.read( self.max_html_size + 1 )
+        if len(l) > self.max_html_size:
+          u.close()
+          return self._skip( url )
+        # Reaching the end of the body
+        reader.read()
+      else:
+        l = reader.read()
+      u.close()
+      self._local.response = u
+      self._succeeded( u.geturl() )
+      if self.metrics is not None:
+        # Decoding happens while reading : its time is taken out of the transfer time
+        decode_time = getattr( reader, "decode_time", 0.0 )
+        self.metrics.timing( "transfer", time.perf_counter() - start - decode_time, url )
+        if reader is not u:
+          self.metrics.timing( "decode", decode_time, url )
+        self.metrics.count( "bytes", getattr( reader, "raw_bytes", len(l) ), url )
     
     except Exception as e:
+      self._local.error = e
+      u.close()
       if debug:
         print("Couldn't read data from socket")
         print(e)
-      self.notfound += 1
-      self.current_url = None
+      self._failed()
       return None
 
+    if self.cache is not None and data is None:
+      self.cache.store( url, l, u.headers )
+
     return l    
 
+  def iter_content(self, url, debug=False, chunk_size=CHUNK_SIZE):
+    """
+    Yields the decoded body of url chunk by chunk, so that large resources
+    can be processed without being held in memory.
+    Unlike fetch, an exception is raised if url can't be fetched.
+    """
+    with self.throttle( url ):
+      u = self._open(url, debug, None, {"Accept-Encoding": ACCEPT_ENCODING})
+      try:
+        reader = decoding_reader( u )
+        while True:
+          chunk = reader.read( chunk_size )
+          if not chunk:
+            break
+          yield chunk
+      finally:
+        u.close()
+
+  def is_html(self, headers, debug=False):
+    """
+    Tells, from response headers, if a body is an html page which should be read :
+    its Content-Type (if any) must be in htmltypes, and its Content-Length (if any)
+    must not exceed max_html_size.
+    """
+    content_type = headers.get("Content-Type")
+    if content_type is not None:
+      content_type = content_type.split(";")[0].strip().lower()
+      if content_type not in self.htmltypes:
+        if debug:
+          print(("Skipping %s content" % content_type))
+        return False
+
+    length = headers.get("Content-Length")
+    if length is not None and self.max_html_size is not None and \
+       content_encoding( headers ) is None and int( length ) > self.max_html_size:
+      if debug:
+        print(("Skipping %s bytes content" % length))
+      return False
+
+    return True
+
+  def throttle(self, url, acquired=False):
+    """
+    Returns a context manager surrounding a request to url, which waits
+    for the scheduler to allow it (see scheduler.HostScheduler.request).
+    """
+    if self.scheduler is None:
+      return contextlib.nullcontext()
+    return self.scheduler.request( urllib.parse.urlsplit( url ).hostname, acquired )
+
+  def close(self):
+    """
+    Closes connections kept alive by the fetcher pool, and saves its cache.
+    """
+    self.pool.close()
+    if self.cache is not None:
+      self.cache.close()
+
+  def _skip(self, url):
+    with self._lock:
+      self.skipped += 1
+      self.current_url = None
+    return None
+
+  def _succeeded(self, url):
+    with self._lock:
+      self.ok += 1
+      self.current_url = url
+
+  def _failed(self):
+    with self._lock:
+      self.notfound += 1
+      self.current_url = None
+
+  def _open(self, url, debug=False, data=None, headers=None, method=None, retry=True):
+    """
+    Sends a request through the connection pool, and returns the response.
+    Failed requests are retried according to the retry policy, unless retry is False.
+    Raises an exception if the url can't be fetched.
+    """
+    host = urllib.parse.urlsplit( url ).hostname
+    if method is None:
+      method = "GET" if data is None else "POST"
+    attempt = 0
+    while True:
+      if self.breaker is not None and not self.breaker.allow( host ):
+        raise CircuitOpenError( host, self.breaker.retry_in( host ) )
+      try:
+        u = self._request(url, debug, data, headers, method)
+      except Exception as e:
+        if self.metrics is not None:
+          self.metrics.count( "requests", 1, url )
+          self.metrics.status( getattr( e, "code", None ) or type(e).__name__, url )
+          self.metrics.maybe_report()
+        if self.breaker is not None:
+          if is_host_failure( e ):
+            self.breaker.failure( host )
+          else:
+            self.breaker.success( host )
+        if not retry or self.retry is None or attempt >= self.retry.retries or not self.retry.is_retryable( e, method ):
+          raise
+        delay = self.retry.delay( attempt, e )
+        if debug:
+          print(("Retrying %s in %.1f seconds" % (url, delay)))
+        time.sleep( delay )
+        attempt += 1
+        continue
+
+      if self.metrics is not None:
+        self.metrics.count( "requests", 1, url )
+        self.metrics.status( u.status, url )
+        self.metrics.maybe_report()
+      if self.breaker is not None:
+        self.breaker.success( host )
+      return u
+
+  def _request(self, url, debug=False, data=None, headers=None, method=None):
+    if isinstance(data, str):
+      data = data.encode("ascii")
+
+    headers = dict( headers or {} )
+    headers["User-Agent"] = USER_AGENT
+
+    if isinstance(self.proxy, ProxyPool):
+      proxy = self.proxy.acquire( urllib.parse.urlsplit( url ).hostname )
+      if debug:
+        print(("Using proxy %s" % proxy))
+      start = time.perf_counter()
+      try:
+        u = self.pool.urlopen(url, data=data, headers=headers, proxy=proxy, method=method)
+      except Exception as e:
+        self.proxy.release( proxy, failed=is_proxy_failure( e ) )
+        raise
+      self.proxy.release( proxy, time.perf_counter() - start )
+      return u
+
+    proxy = None
+    # A single proxy is only used for http requests
+    if self.proxy != None and urllib.parse.urlsplit( url ).scheme == "http":
+      if debug:
+        print(("Using proxy %s" % self.proxy))
+      proxy = self.proxy
+    return self.pool.urlopen(url, data=data, headers=headers, proxy=proxy, method=method)
+
   def get_current_url(self):
-    return self.current_url    
+    return self.current_url
+
+  def get_last_error(self):
+    """
+    Returns the exception which made the last fetch or download of the current thread fail, or None.
+    """
+    return getattr( self._local, "error", None )
+
+  def get_last_response(self):
+    """
+    Returns the response (status, reason, headers, and the method and headers of its request)
+    of the last fetch of the current thread, or None if it failed or its body came from the cache.
+    """
+    return getattr( self._local, "response", None )    
     
   
@@ -0,0 +1,199 @@
+# -*- coding: utf8 -*-
+
+import collections, sqlite3, time, urllib.parse
+
+__author__ = "glebourgeois@me.com"
+
+# States of urls stored by a frontier
+QUEUED = 0
+RUNNING = 1
+DONE = 2
+
+def url_host(url):
+  return urllib.parse.urlsplit( url ).hostname or ""
+
+
+class Frontier:
+  """
+  In-memory crawl frontier : urls waiting to be fetched, grouped by host,
+  and the set of urls already seen.
+  """
+
+  def __init__(self, visited=None):
+    """
+    :param visited: Optional set of already seen urls, updated by the frontier.
+      Any object with add and __contains__ fits, as a bloom.BloomFilter.
+    """
+    self.visited = visited if visited is not None else set()
+    self.followed = 0
+    self._queues = collections.OrderedDict() # host -> deque of (url, depth, base domain)
+
+  def add(self, url, depth, base_domain, key=None):
+    """
+    Queues url, unless it has already been seen. Returns True if url is queued.
+    key is the form of url compared to seen ones (a canonical url), url itself if None.
+    """
+    if key is None:
+      key = url
+    if key in self.visited:
+      return False
+    self.visited.add( key )
+    self._queues.setdefault( url_host( url ), collections.deque() ).append( (url, depth, base_domain) )
+    return True
+
+  def requeue(self, url, depth, base_domain):
+    """
+    Queues again an url already popped (for instance to retry it).
+    """
+    self._queues.setdefault( url_host( url ), collections.deque() ).append( (url, depth, base_domain) )
+
+  def hosts(self):
+    """
+    Returns hosts having queued urls, least recently served first.
+    """
+    return list( self._queues.keys() )
+
+  def pop(self, host):
+    """
+    Returns the next (url, depth, base domain) queued for host, or None.
+    """
+    queue = self._queues.get( host )
+    if queue is None:
+      return None
+    entry = queue.popleft()
+    if len(queue) == 0:
+      del self._queues[host]
+    return entry
+
+  def rotate(self, host):
+    """
+    Moves host at the end of the hosts list, so that other hosts are served first.
+    """
+    if host in self._queues:
+      self._queues.move_to_end( host )
+
+  def done(self, url):
+    """
+    Records that url has been entirely processed.
+    """
+    pass
+
+  def checkpoint(self):
+    pass
+
+  def close(self):
+    pass
+
+  def __len__(self):
+    return sum( [len(q) for q in self._queues.values()] )
+
+
+class SQLiteFrontier(Frontier):
+  """
+  Crawl frontier persisted in a SQLite file, with the set of seen urls.
+  Changes are committed every checkpoint_every operations or checkpoint_delay seconds,
+  and when the frontier is closed. Opening an existing file resumes its crawl :
+  urls which were being processed when it stopped are queued again.
+  """
+
+  def __init__(self, path, checkpoint_every=1000, checkpoint_delay=30):
+    """
+    :param path: Path of the SQLite file, created if needed
+    :param checkpoint_every: Number of operations between two commits
+    :param checkpoint_delay: Maximum number of seconds between two commits
+    """
+    self.path = path
+    self.checkpoint_every = checkpoint_every
+    self.checkpoint_delay = checkpoint_delay
+
+    self._db = sqlite3.connect( path, check_same_thread=False )
+    self._db.execute( "CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, host TEXT, depth INTEGER, base TEXT, state INTEGER, seq INTEGER, key TEXT)" )
+    if "key" not in [c[1] for c in self._db.execute( "PRAGMA table_info(urls)" )]:
+      # File written before urls had a key distinct from them
+      self._db.execute( "ALTER TABLE urls ADD COLUMN key TEXT" )
+      self._db.execute( "UPDATE urls SET key = url" )
+    self._db.execute( "CREATE INDEX IF NOT EXISTS urls_queue ON urls (host, state, seq)" )
+    self._db.execute( "CREATE UNIQUE INDEX IF NOT EXISTS urls_key ON urls (key)" )
+    self._db.execute( "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)" )
+    self._db.execute( "UPDATE urls SET state = ? WHERE state = ?", (QUEUED, RUNNING) )
+    self._db.commit()
+
+    row = self._db.execute( "SELECT value FROM meta WHERE name = 'followed'" ).fetchone()
+    self.followed = row[0] if row is not None else 0
+    self._seq = self._db.execute( "SELECT COALESCE(MAX(seq), 0) FROM urls" ).fetchone()[0]
+
+    self._counts = collections.OrderedDict() # host -> number of queued urls
+    for host, count in self._db.execute( "SELECT host, COUNT(*) FROM urls WHERE state = ? GROUP BY host", (QUEUED,) ):
+      self._counts[host] = count
+
+    self._operations = 0
+    self._last_checkpoint = time.time()
+
+  def add(self, url, depth, base_domain, key=None):
+    if key is None:
+      key = url
+    self._seq += 1
+    host = url_host( url )
+    cursor = self._db.execute( "INSERT OR IGNORE INTO urls VALUES (?, ?, ?, ?, ?, ?, ?)", (url, host, depth, base_domain, QUEUED, self._seq, key) )
+    if cursor.rowcount == 0:
+      return False
+    self._counts[host] = self._counts.get( host, 0 ) + 1
+    self._changed()
+    return True
+
+  def requeue(self, url, depth, base_domain):
+    self._seq += 1
+    host = url_host( url )
+    self._db.execute( "UPDATE urls SET state = ?, seq = ? WHERE url = ?", (QUEUED, self._seq, url) )
+    self._counts[host] = self._counts.get( host, 0 ) + 1
+    self._changed()
+
+  def __contains__(self, key):
+    return self._db.execute( "SELECT 1 FROM urls WHERE key = ?", (key,) ).fetchone() is not None
+
+  def hosts(self):
+    return list( self._counts.keys() )
+
+  def pop(self, host):
+    if host not in self._counts:
+      return None
+    row = self._db.execute( "SELECT url, depth, base FROM urls WHERE host = ? AND state = ? ORDER BY seq LIMIT 1", (host, QUEUED) ).fetchone()
+    if row is None:
+      del self._counts[host]
+      return None
+    self._db.execute( "UPDATE urls SET state = ? WHERE url = ?", (RUNNING, row[0]) )
+    self._counts[host] -= 1
+    if self._counts[host] == 0:
+      del self._counts[host]
+    self._changed()
+    return (row[0], row[1], row[2])
+
+  def rotate(self, host):
+    if host in self._counts:
+      self._counts.move_to_end( host )
+
+  def done(self, url):
+    self._db.execute( "UPDATE urls SET state = ? WHERE url = ?", (DONE, url) )
+    self._changed()
+
+  def checkpoint(self):
+    """
+    Commits pending changes to the SQLite file.
+    """
+    self._db.execute( "INSERT OR REPLACE INTO meta VALUES ('followed', ?)", (self.followed,) )
+    self._db.commit()
+    self._operations = 0
+    self._last_checkpoint = time.time()
+
+  def close(self):
+    self.checkpoint()
+    self._db.close()
+
+  def __len__(self):
+    return sum( self._counts.values() )
+
+  def _changed(self):
+    self._operations += 1
+    if self._operations >= self.checkpoint_every or \
+       time.time() - self._last_checkpoint > self.checkpoint_delay:
+      self.checkpoint()
@@ -1,15 +1,177 @@
 import xml.dom
+import bisect
+import collections
+import hashlib
 import re
+import urllib.parse
 
 import html5lib
+import html5lib.tokenizer
 import html5lib.treewalkers
+import html5lib.treewalkers.dom
 import html5lib.serializer
+from html5lib.constants import tokenTypes, contentModelFlags
 
 
 __author__ = "samuel.charron@gmail.com"
 
-def absolute_xpath(node):
-  "Generate an absolute xpath from a node."
+_tag_types = (xml.dom.Node.ELEMENT_NODE, xml.dom.Node.DOCUMENT_NODE)
+
+def walk(node, skip = None):
+  """
+    Iterative depth-first traversal of the subtree rooted at *node*, without recursion, so that
+    any nesting depth is handled. Yields (node, entering) pairs : each node is yielded with
+    entering = True before its children, and with entering = False after them.
+    Children of nodes for which *skip* returns True are not visited.
+    Children are read when their parent is resumed, so a caller may modify them while entering it.
+  """
+  stack = [(node, False)]
+  while len(stack) > 0:
+    (n, visited) = stack.pop()
+    if visited:
+      yield (n, False)
+      continue
+    yield (n, True)
+    stack.append((n, True))
+    if skip is None or not skip(n):
+      stack.extend((child, False) for child in reversed(n.childNodes))
+
+def iter_nodes(node, order = "pre", node_types = None, tags = None, skip = None):
+  """
+    Lazily yield nodes of the subtree rooted at *node* (itself included), in pre-order (parents before
+    their children) or post-order (children before their parents).
+    Only nodes whose nodeType is in *node_types*, and elements whose name is in *tags*, are yielded if
+    given. Children of nodes for which *skip* returns True are not visited (see walk).
+  """
+  entering = (order == "pre")
+  for (n, event) in walk(node, skip):
+    if event != entering:
+      continue
+    if node_types is not None and n.nodeType not in node_types:
+      continue
+    if tags is not None and (n.nodeType != xml.dom.minidom.Node.ELEMENT_NODE or n.nodeName not in tags):
+      continue
+    yield n
+
+
+class DocumentIndex:
+  """
+    Index of a parsed document, built in one pass : position of each node among
+    its siblings (as used in XPaths), depth, pre-order and post-order numbers, number
+    of tags of each subtree, and tag name -> nodes.
+    absolute_xpath, find_tags and count_tags answer from it when it is given to them,
+    instead of walking the tree. The index must be rebuilt if the document is modified.
+  """
+
+  def __init__(self, doc):
+    self.doc = doc
+    self.nodes = []     # nodes in document (pre) order
+    self.pre = {}       # node -> pre-order number (index in nodes)
+    self.post = {}      # node -> post-order number
+    self.depths = {}    # node -> depth, 0 for doc
+    self.positions = {} # node -> position among same name siblings (element) or text siblings (text)
+    self.sizes = {}     # node -> number of nodes of its subtree
+    self.tag_counts = {} # node -> number of element and document nodes of its subtree
+    self.tags = {}      # tag name -> elements in document order
+    self._tag_pre = {}  # tag name -> pre-order numbers of its elements (sorted)
+    self._xpaths = {doc: ""}
+
+    post = 0
+    for (node, entering) in walk(doc):
+      if not entering:
+        self.post[node] = post
+        post += 1
+        self.sizes[node] = len(self.nodes) - self.pre[node]
+        count = 1 if node.nodeType in (xml.dom.minidom.Node.ELEMENT_NODE, xml.dom.minidom.Node.DOCUMENT_NODE) else 0
+        for child in node.childNodes:
+          count += self.tag_counts[child]
+        self.tag_counts[node] = count
+        continue
+
+      self.pre[node] = len(self.nodes)
+      self.nodes.append( node )
+      parent = node.parentNode
+      self.depths[node] = 0 if node is doc else self.depths[parent] + 1
+      if node.nodeType == xml.dom.minidom.Node.ELEMENT_NODE:
+        self.tags.setdefault( node.nodeName, [] ).append( node )
+        self._tag_pre.setdefault( node.nodeName, [] ).append( self.pre[node] )
+
+      # Positions of children, counted by name
+      counts = {}
+      for child in node.childNodes:
+        if child.nodeType == xml.dom.minidom.Node.ELEMENT_NODE:
+          key = child.nodeName
+        elif child.nodeType == xml.dom.minidom.Node.TEXT_NODE:
+          key = "#text"
+        else:
+          continue
+        counts[key] = counts.get( key, 0 ) + 1
+        self.positions[child] = counts[key]
+
+  def depth(self, node):
+    return self.depths[node]
+
+  def position(self, node):
+    """
+      Position of node among its siblings of the same name (elements) or among text siblings (text nodes), from 1.
+    """
+    return self.positions.get( node, 1 )
+
+  def is_ancestor(self, ancestor, node):
+    "Tell in constant time if *ancestor* is a strict ancestor of *node*."
+    return self.pre[ancestor] < self.pre[node] and self.post[node] < self.post[ancestor]
+
+  def subtree(self, node):
+    "Return nodes of the subtree rooted at *node*, in document order."
+    start = self.pre[node]
+    return self.nodes[start:start + self.sizes[node]]
+
+  def xpath(self, node):
+    "Absolute xpath of *node* (see absolute_xpath), computed once for each node."
+    # Going up to the closest ancestor whose xpath is known. Only the xpath of *node* is
+    # kept : keeping those of all its ancestors would take memory quadratic in the depth.
+    target = node
+    steps = []
+    while node not in self._xpaths:
+      if node.nodeType == xml.dom.minidom.Node.ELEMENT_NODE:
+        steps.append( "/%s[%i]" % (node.nodeName, self.positions[node]) )
+      elif node.nodeType == xml.dom.minidom.Node.TEXT_NODE:
+        steps.append( "/text()[%i]" % self.positions[node] )
+      node = node.parentNode
+    steps.append( self._xpaths[node] )
+    xpath = "".join( reversed( steps ) )
+    self._xpaths[target] = xpath
+    return xpath
+
+  def find_tags(self, node, tag_set):
+    "Find nodes of the subtree of *node* with name contained in *tag_set* (see find_tags), in document order."
+    if node.nodeType != xml.dom.minidom.Node.ELEMENT_NODE:
+      return []
+    start = self.pre[node]
+    end = start + self.sizes[node]
+    found = []
+    for tag in tag_set:
+      keys = self._tag_pre.get( tag )
+      if keys is None:
+        continue
+      found += self.tags[tag][bisect.bisect_left( keys, start ):bisect.bisect_left( keys, end )]
+    if len(tag_set) > 1:
+      found.sort( key=self.pre.get )
+    return found
+
+  def count_tags(self, node):
+    "Number of tags of the subtree rooted at *node* (see count_tags)."
+    return self.tag_counts[node]
+
+
+def absolute_xpath(node, index = None):
+  """
+    Generate an absolute xpath from a node.
+    With a DocumentIndex of its document, positions are not computed again.
+  """
+  if index is not None:
+    return index.xpath(node)
+
   xpath = ""
   while node.nodeType != xml.dom.minidom.Node.DOCUMENT_NODE:
     pos = 1
@@ -37,22 +199,24 @@ def node_signature2(node, pretty = False, level = 0):
     Generate a signature for a node. It's a flat (= string) representation of node's tree.
     With pretty = True, each node is on its line and subtrees are indented using level.
   """
-  sig = ""
-  if node.nodeType == xml.dom.minidom.Node.ELEMENT_NODE or node.nodeType == xml.dom.minidom.Node.DOCUMENT_NODE:
-    lsig = ""
-    for child in node.childNodes:
-      lsig = lsig + node_signature2(child, pretty = pretty, level = level + 1)
-
-    name = node.nodeName
+  # Parts are joined once at the end, rather than concatenated at each level
+  parts = []
+  for (n, entering) in walk(node, skip = lambda n: n.nodeType not in _tag_types):
+    if n.nodeType not in _tag_types:
+      continue
+    if not entering:
+      level -= 1
+      if not pretty:
+        parts.append(")")
+      continue
 
     if pretty:
-      for i in range(level):
-        name = ' ' + name
-      sig = name + "\n" + lsig
+      parts.append(" " * level + n.nodeName + "\n")
     else:
-      sig = name + "(" + lsig + ")"
+      parts.append(n.nodeName + "(")
+    level += 1
 
-  return sig
+  return "".join(parts)
 
 def node_signature(node, pretty = False, level = 0):
   sig = node_signature2(node, pretty, level)
@@ -91,12 +255,269 @@ def get_nodes_matching_signature2(node, presig, signature, pretty = False, level
 
   return (sig, nodes)
 
-def get_nodes_matching_signature(node, signature, pretty = False):
+def get_nodes_matching_signature(node, signature, pretty = False, index = None):
   """
     Return nodes matching the given *signature* (see node_signature).
+    Signatures are compared through their structural hash (see SignatureIndex) : with an *index*,
+    nodes of all the documents it indexed are returned from a single lookup.
+  """
+  if index is None:
+    index = SignatureIndex(node)
+  return index.find(signature, pretty)
+
+
+def _digest(data):
+  return hashlib.blake2b(data, digest_size=8).digest()
+
+def _path_digest(parent_path, parent_name):
+  return _digest(parent_path + parent_name.encode("utf-8") + b">")
+
+def _subtree_digest(name, child_digests):
+  return _digest(name.encode("utf-8") + b"(" + b"".join(child_digests) + b")")
+
+def _signature_hash(path, subtree):
+  return int.from_bytes(_digest(path + subtree), "big")
+
+def hash_signature(signature, pretty = False):
+  """
+    Return the structural hash of a signature string (see node_signature), as SignatureIndex
+    computes it from nodes. A signature made for a search under a node (see
+    get_nodes_matching_signature) starts with the names of its ancestors up to that node.
+    Return None for an empty or malformed signature, which no node can match.
+  """
+  if pretty:
+    lines = [line for line in signature.split("\n") if len(line) > 0]
+    if len(lines) == 0:
+      return None
+    head = lines[0]
+    names = []
+    for line in lines[1:]:
+      stripped = line.lstrip(" ")
+      names.append((len(line) - len(stripped), stripped))
+  elif "(" in signature:
+    head = signature[:signature.index("(")]
+  else:
+    return None
+
+  prefix = head.split(">")
+  path = b""
+  for name in prefix[:-1]:
+    path = _path_digest(path, name)
+
+  # Stack of (name, depth, digests of children) of open nodes
+  root = prefix[-1].lstrip(" ")
+  stack = [(root, len(prefix[-1]) - len(root), [])]
+  if pretty:
+    for (depth, name) in names:
+      while stack[-1][1] >= depth:
+        if len(stack) == 1:
+          # Not indented under the root
+          return None
+        (closed, d, children) = stack.pop()
+        stack[-1][2].append(_subtree_digest(closed, children))
+      stack.append((name, depth, []))
+    while len(stack) > 1:
+      (closed, d, children) = stack.pop()
+      stack[-1][2].append(_subtree_digest(closed, children))
+  else:
+    name = ""
+    rest = signature[len(head) + 1:]
+    for (i, c) in enumerate(rest):
+      if c == "(":
+        stack.append((name, 0, []))
+        name = ""
+      elif c == ")":
+        if len(name) > 0:
+          return None
+        (closed, d, children) = stack.pop()
+        if len(stack) == 0:
+          stack.append((closed, d, children))
+          break
+        stack[-1][2].append(_subtree_digest(closed, children))
+      else:
+        name += c
+    else:
+      # The root is never closed
+      return None
+    if i + 1 < len(rest):
+      return None
+
+  (name, d, children) = stack[0]
+  return _signature_hash(path, _subtree_digest(name, children))
+
+
+class SignatureIndex:
+  """
+    Structural hashes of the element subtrees of one or several documents, computed bottom-up
+    in one pass : the hash of a subtree combines its tag name with the hashes of its children,
+    so no signature string is built. The signature hash of a node also covers the names of its
+    ancestors, as node_signature does. Nodes are indexed by signature hash, so that finding all
+    nodes with a given signature, among thousands of pages, is a dictionary lookup.
+    Readable signatures are only built on demand (see signature).
+  """
+
+  def __init__(self, root = None):
+    self.subtree_hashes = {} # node -> digest of its subtree structure (node_signature2)
+    self.hashes = {}         # node -> signature hash (node_signature, relative to the indexed root)
+    self.nodes = {}          # signature hash -> nodes, children before their parent
+    self.roots = []
+    if root is not None:
+      self.add(root)
+
+  def add(self, root):
+    """
+      Index element nodes of the subtree of *root* (usually a document).
+    """
+    self.roots.append(root)
+    paths = {root: b""}
+    for (node, entering) in walk(root, skip = lambda n: n.nodeType not in _tag_types):
+      if node.nodeType not in _tag_types:
+        continue
+
+      if not entering:
+        children = [self.subtree_hashes[c] for c in node.childNodes if c in self.subtree_hashes]
+        subtree = _subtree_digest(node.nodeName, children)
+        self.subtree_hashes[node] = subtree
+        h = _signature_hash(paths.pop(node), subtree)
+        self.hashes[node] = h
+        self.nodes.setdefault(h, []).append(node)
+        continue
+
+      path = _path_digest(paths[node], node.nodeName)
+      for child in node.childNodes:
+        if child.nodeType == xml.dom.minidom.Node.ELEMENT_NODE:
+          paths[child] = path
+
+  def signature_hash(self, node):
+    return self.hashes[node]
+
+  def subtree_hash(self, node):
+    "Hash of the structure of the subtree of *node*, whatever its ancestors are."
+    return int.from_bytes(self.subtree_hashes[node], "big")
+
+  def find(self, signature, pretty = False):
+    """
+      Return indexed nodes matching *signature*, given as a string (see node_signature) or a hash.
+      An empty or malformed signature matches no node.
+    """
+    if isinstance(signature, str):
+      signature = hash_signature(signature, pretty)
+    if signature is None:
+      return []
+    return list(self.nodes.get(signature, []))
+
+  def signature(self, node, pretty = False):
+    "Build the readable signature of *node*, relative to its indexed root."
+    sig = node_signature2(node, pretty)
+    roots = set(self.roots)
+    parent = node.parentNode
+    while parent is not None and node not in roots:
+      sig = parent.nodeName + ">" + sig
+      node = parent
+      parent = parent.parentNode
+    return sig
+
+
+_spaces_re = re.compile(r"\s+", re.UNICODE)
+
+class TemplateModel:
+  """
+    Site-level model of the template shared by pages of a domain. Subtrees recurring,
+    with the same structure, position and text, in at least *threshold* of the pages
+    added are considered boilerplate (menus, headers, footers...).
+    Pages are added one at a time, and counts are updated incrementally. Once *min_pages*
+    pages have been added, boilerplate subtrees of a page are found, stripped, or skipped
+    while gathering its text, in a single pass.
   """
 
-  return get_nodes_matching_signature2(node, "", signature, pretty=pretty, level=0)[1]
+  def __init__(self, threshold = 0.6, min_pages = 5):
+    self.threshold = threshold
+    self.min_pages = min_pages
+    self.pages = 0
+    self.counts = {} # subtree key -> number of pages having it
+
+  def _scan(self, doc, with_text = False):
+    """
+      Post-order pass over *doc*, returning (keys of its element subtrees, topmost boilerplate
+      nodes, text parts outside of them). A subtree key hashes its ancestor path, structure and text.
+    """
+    keys = set()
+    boilerplate = []
+    parts = []
+    known = self.pages >= self.min_pages
+    paths = {doc: b""}
+    digests = {}
+    starts = {} # node -> (len(boilerplate), len(parts)) when it was entered
+
+    for (node, entering) in walk(doc):
+      if not entering and node.nodeType not in _tag_types:
+        continue
+      if node.nodeType == xml.dom.minidom.Node.TEXT_NODE:
+        digests[node] = _digest(_spaces_re.sub(" ", node.nodeValue).strip().encode("utf-8"))
+        if with_text and not filter_useless_tags(node.parentNode.nodeName):
+          parts.append(node.nodeValue)
+        continue
+      if node.nodeType not in _tag_types:
+        if with_text:
+          parts.append(" ")
+        continue
+
+      if not entering:
+        children = [digests.pop(c) for c in node.childNodes if c in digests]
+        digests[node] = _subtree_digest(node.nodeName, children)
+        key = _signature_hash(paths.pop(node), digests[node])
+        keys.add(key)
+        if known and self.is_boilerplate(key):
+          # Boilerplate inside this node is replaced by the node itself, its text is dropped
+          (b, t) = starts[node]
+          del boilerplate[b:]
+          del parts[t:]
+          boilerplate.append(node)
+        starts.pop(node, None)
+        continue
+
+      starts[node] = (len(boilerplate), len(parts))
+      if with_text and node is not doc:
+        parts.append(" ")
+      path = _path_digest(paths[node], node.nodeName)
+      for child in node.childNodes:
+        if child.nodeType == xml.dom.minidom.Node.ELEMENT_NODE:
+          paths[child] = path
+
+    return (keys, boilerplate, parts)
+
+  def add(self, doc):
+    """
+      Count subtrees of a parsed page of the site.
+    """
+    (keys, boilerplate, parts) = self._scan(doc)
+    for key in keys:
+      self.counts[key] = self.counts.get(key, 0) + 1
+    self.pages += 1
+
+  def is_boilerplate(self, key):
+    return self.pages >= self.min_pages and self.counts.get(key, 0) >= self.threshold * self.pages
+
+  def boilerplate_nodes(self, doc):
+    "Return topmost boilerplate nodes of *doc*, in document order."
+    return self._scan(doc)[1]
+
+  def strip(self, doc):
+    """
+      Remove boilerplate subtrees from *doc*, and return their number.
+    """
+    nodes = self.boilerplate_nodes(doc)
+    for node in nodes:
+      if node.parentNode is not None:
+        node.parentNode.removeChild(node).unlink()
+    return len(nodes)
+
+  def content_text(self, doc):
+    """
+      Return the text of *doc* outside of boilerplate subtrees (as get_text_from_subtree would
+      once they are stripped), without modifying it.
+    """
+    return "".join(self._scan(doc, with_text = True)[2])
 
   
 def exact_matcher_ci(node_text, ref_text):
@@ -120,11 +541,11 @@ def find_matcher_ci(node_text, ref_text):
   else:
     return None
 
-__strip_non_alnum_re = re.compile("[^a-zA-Z0-9]", re.S | re.M | re.I)
+_strip_non_alnum_re = re.compile("[^a-zA-Z0-9]", re.S | re.M | re.I)
 def alnum_find_matcher_ci(node_text, ref_text):
   "Filter node_text and ref_text keeping only alnum characters, then same behaviour than find_matcher_ci"
-  node_text = __strip_non_alnum_re.sub('', node_text)
-  ref_text = __strip_non_alnum_re.sub('', ref_text)
+  node_text = _strip_non_alnum_re.sub('', node_text)
+  ref_text = _strip_non_alnum_re.sub('', ref_text)
 
   if node_text.lower().find(ref_text.lower()) != -1:
     return ("alnum_find_matcher_ci", len(ref_text) / len(node_text))
@@ -158,45 +579,170 @@ def find_text(node, text, matcher = exact_matcher_ci, tag_filter = dont_filter):
     It also takes a tag_filter, a function that can be used to filter out some nodes, returning True for nodes to not follow.
     This function returns list of (return values of matcher, matching node) pairs.
   """
-  if node.nodeType == xml.dom.minidom.Node.TEXT_NODE:
-    ret = matcher(node.nodeValue, text)
-    if ret is None:
-      return []
-    else:
-      return [(ret, node)]
+  return list(iter_find_text(node, text, matcher, tag_filter))
 
-  elif node.nodeType == xml.dom.minidom.Node.ELEMENT_NODE or node.nodeType == xml.dom.minidom.Node.DOCUMENT_NODE:
-    if tag_filter(node.nodeName):
-      return []
-    else:
-      l = []
-      for child in node.childNodes:
-        l += find_text(child, text, matcher=matcher, tag_filter=tag_filter)
+def iter_find_text(node, text, matcher = exact_matcher_ci, tag_filter = dont_filter):
+  """
+    Same as find_text, but yields (return value of matcher, matching node) pairs lazily.
+  """
+  filtered = lambda n: n.nodeType in _tag_types and tag_filter(n.nodeName)
+  for (n, entering) in walk(node, skip = filtered):
+    if n.nodeType == xml.dom.minidom.Node.TEXT_NODE:
+      if entering:
+        ret = matcher(n.nodeValue, text)
+        if ret is not None:
+          yield (ret, n)
+
+    # Alt attributes are matched after the children of their node
+    elif not entering and n.nodeType in _tag_types and not filtered(n) and n.attributes is not None:
+      for i in range(n.attributes.length):
+        attr = n.attributes.item(i)
+        if attr.name == "alt":
+          ret = matcher(attr.value, text)
+          if ret is not None:
+            yield (ret, n)
+
+
+class TextAutomaton:
+  """
+    Aho-Corasick automaton of many reference texts, finding all of them in a text in a
+    single scan. *mode* tells how texts are compared, as matchers do :
 
-      if node.attributes is not None:
-        for i in range(node.attributes.length):
-          attr = node.attributes.item(i)
-          if attr.name in set(["alt"]):
-            ret = matcher(attr.value, text)
-            if ret is not None:
-              l += [(ret, node)]
+      - exact_ci: the whole text, case insensitive (exact_matcher_ci)
+      - find: occurence, case sensitive (find_matcher)
+      - find_ci: occurence, case insensitive (find_matcher_ci)
+      - alnum_find_ci: occurence, keeping only alnum characters, case insensitive (alnum_find_matcher_ci)
 
-      return l
+    Patterns are normalized once when the automaton is built.
+  """
 
-  # Not a text node nor an element node
-  return []
+  modes = ("exact_ci", "find", "find_ci", "alnum_find_ci")
+
+  def __init__(self, texts, mode = "find_ci"):
+    if mode not in self.modes:
+      raise ValueError("Unknown mode %s" % mode)
+    self.texts = list(texts)
+    self.mode = mode
+
+    self._patterns = {} # normalized pattern -> indexes of texts
+    for (i, text) in enumerate(self.texts):
+      self._patterns.setdefault(self.normalize(text), []).append(i)
+
+    if mode == "exact_ci":
+      return
+
+    # Trie of patterns : transitions, failure links, and indexes of texts ending at each state
+    self._goto = [{}]
+    self._fail = [0]
+    self._out = [[]]
+    for (pattern, indexes) in self._patterns.items():
+      state = 0
+      for c in pattern:
+        nxt = self._goto[state].get(c)
+        if nxt is None:
+          nxt = len(self._goto)
+          self._goto[state][c] = nxt
+          self._goto.append({})
+          self._fail.append(0)
+          self._out.append([])
+        state = nxt
+      self._out[state] = self._out[state] + indexes
+
+    # Breadth first, so that failure links point to already completed states
+    queue = collections.deque(self._goto[0].values())
+    while len(queue) > 0:
+      state = queue.popleft()
+      for (c, nxt) in self._goto[state].items():
+        queue.append(nxt)
+        f = self._fail[state]
+        while f != 0 and c not in self._goto[f]:
+          f = self._fail[f]
+        target = self._goto[f].get(c, 0)
+        self._fail[nxt] = target if target != nxt else 0
+        if len(self._out[self._fail[nxt]]) > 0:
+          self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+  def normalize(self, text):
+    "Transform *text* as the mode requires, before patterns are looked for."
+    if self.mode == "find":
+      return text
+    if self.mode == "alnum_find_ci":
+      text = _strip_non_alnum_re.sub('', text)
+    return text.lower()
+
+  def search(self, text):
+    """
+      Return the list of (index of reference text, score) of reference texts found in *text*.
+      As matchers do, scores are the length ratio of the reference text and *text*.
+    """
+    normalized = self.normalize(text)
+    if self.mode == "exact_ci":
+      return [(i, 1) for i in self._patterns.get(normalized, [])]
+
+    found = set(self._patterns.get("", []))
+    state = 0
+    goto = self._goto
+    fail = self._fail
+    out = self._out
+    for c in normalized:
+      while state != 0 and c not in goto[state]:
+        state = fail[state]
+      state = goto[state].get(c, 0)
+      if len(out[state]) > 0:
+        found.update(out[state])
+
+    hits = []
+    for i in sorted(found):
+      if self.mode == "alnum_find_ci":
+        length = len(_strip_non_alnum_re.sub('', self.texts[i]))
+      else:
+        length = len(self.texts[i])
+      hits.append((i, length / len(normalized) if len(normalized) > 0 else 1))
+    return hits
+
+
+def find_texts(node, texts, mode = "find_ci", tag_filter = dont_filter):
+  """
+    Find text nodes matching any of *texts* (or alt attributes, as find_text does), in a single traversal.
+    *texts* is a list of reference texts, compiled in a TextAutomaton according to *mode*, or an
+    already built TextAutomaton. *mode* may also be given as a matcher function (find_matcher_ci, ...).
+    This function returns the list of (reference text, matching node, score) triples.
+  """
+  if not isinstance(texts, TextAutomaton):
+    mode = _matcher_modes.get(mode, mode)
+    texts = TextAutomaton(texts, mode)
+
+  hits = []
+  filtered = lambda n: n.nodeType in _tag_types and tag_filter(n.nodeName)
+  for (n, entering) in walk(node, skip = filtered):
+    if n.nodeType == xml.dom.minidom.Node.TEXT_NODE:
+      if entering:
+        for (i, score) in texts.search(n.nodeValue):
+          hits.append((texts.texts[i], n, score))
 
+    # As find_text, alt attributes are matched after the children of their node
+    elif not entering and n.nodeType in _tag_types and not filtered(n) and n.attributes is not None:
+      for k in range(n.attributes.length):
+        attr = n.attributes.item(k)
+        if attr.name == "alt":
+          for (i, score) in texts.search(attr.value):
+            hits.append((texts.texts[i], n, score))
 
-def find_tags(node, tag_set):
-  "Find nodes with name contained in *tag_set*"
-  l = []
+  return hits
 
-  if node.nodeType == xml.dom.minidom.Node.ELEMENT_NODE:
-    if node.nodeName in tag_set:
-      l = [node]
-    for child in node.childNodes:
-      l += find_tags(child, tag_set)
-  return l
+_matcher_modes = {exact_matcher_ci: "exact_ci", find_matcher: "find", find_matcher_ci: "find_ci", alnum_find_matcher_ci: "alnum_find_ci"}
+
+def find_tags(node, tag_set, index = None):
+  """
+    Find nodes with name contained in *tag_set*.
+    With a DocumentIndex of its document, the tree is not walked.
+  """
+  if index is not None:
+    return index.find_tags(node, tag_set)
+
+  if node.nodeType != xml.dom.minidom.Node.ELEMENT_NODE:
+    return []
+  return list(iter_nodes(node, tags = tag_set))
 
 def highlight_node(node, color):
   """
@@ -250,7 +796,7 @@ def extract_doc_links(doc):
   Returns a dictionary with link as key, and value as a tuple (dom element, link text).
   """
   ret = {}
-  for link in doc.getElementsByTagName("a"):
+  for link in iter_nodes(doc, tags = set(["a"])):
     href = link.getAttribute("href")
     content = ""
     for child in link.childNodes:
@@ -261,46 +807,124 @@ def extract_doc_links(doc):
     
   return ret
 
-def count_tags(node):
+# Elements whose content is not markup, as html5lib parser tells its tokenizer
+__cdata_tags = set(["script", "style", "xmp", "iframe", "noembed", "noframes", "noscript"])
+__rcdata_tags = set(["textarea", "title"])
+
+def extract_links(html, base=False):
+  """
+  Extracts all hyperlinks from a raw html page, without building any tree : only
+  html5lib tokenizer is run, which is much faster than a full parse.
+  Returns the list of href values of <a> tags, in document order, without duplicates.
+  If base is True, links are resolved against the href of the <base> tag, if any.
+  """
+  return _scan_page( html, base, False )[0]
+
+def extract_links_and_text(html, base=False):
+  """
+  Same as extract_links, but also returns the text of the page (without script
+  and style junk), gathered during the same tokenizer pass : (links, text).
+  """
+  return _scan_page( html, base, True )
+
+def _scan_page(html, base, with_text):
+  tokenizer = html5lib.tokenizer.HTMLTokenizer( html )
+  start_tags = (tokenTypes["StartTag"], tokenTypes["EmptyTag"])
+  characters = (tokenTypes["Characters"], tokenTypes["SpaceCharacters"])
+  end_tag = tokenTypes["EndTag"]
+  base_href = None
+  links = []
+  seen = set()
+  text = []
+  skipped = None # name of the script-like element whose content is being ignored
+
+  for token in tokenizer:
+    if token["type"] in characters:
+      if with_text and skipped is None:
+        text.append( token["data"] )
+      continue
+    if token["type"] == end_tag:
+      if token["name"] == skipped:
+        skipped = None
+      elif with_text:
+        text.append( " " )
+      continue
+    if token["type"] not in start_tags:
+      continue
+    name = token["name"]
+    if with_text:
+      text.append( " " )
+
+    if name == "a" or (base and name == "base" and base_href is None):
+      href = None
+      for attr, value in token["data"]:
+        if attr == "href":
+          href = value.strip()
+          break
+      if href is None:
+        continue
+      if name == "base":
+        base_href = href
+      elif href not in seen:
+        seen.add( href )
+        links.append( href )
+
+    # Content of these elements is not markup, as the parser would do
+    elif name in __cdata_tags:
+      tokenizer.contentModelFlag = contentModelFlags["CDATA"]
+      skipped = name
+    elif name in __rcdata_tags:
+      tokenizer.contentModelFlag = contentModelFlags["RCDATA"]
+    elif name == "plaintext":
+      tokenizer.contentModelFlag = contentModelFlags["PLAINTEXT"]
+
+  if base_href is not None:
+    links = [l if len(l) < 1 or l[0] == '#' else urllib.parse.urljoin( base_href, l ) for l in links]
+
+  return (links, "".join( text ))
+
+def count_tags(node, index = None):
   """
     Count the number of tags of the subtree rooted at the given *node*.
+    With a DocumentIndex of its document, the count is read from it.
   """
-  if node.nodeType == xml.dom.minidom.Node.ELEMENT_NODE or \
-     node.nodeType == xml.dom.minidom.Node.DOCUMENT_NODE:
-    ret = 1
-    for child in node.childNodes:
-      ret += count_tags(child)
-    return ret
-  return 0
+  if index is not None:
+    return index.count_tags(node)
+
+  ret = 0
+  for n in iter_nodes(node, node_types = _tag_types):
+    ret += 1
+  return ret
 
 def print_node(node, level = 0):
   """
     Print the subtree rooted at *node*, with children and text nodes indented.
     element node are indented with ' ' (spaces), text nodes with '.' (dots)
   """
-  if node.nodeType == xml.dom.minidom.Node.ELEMENT_NODE or node.nodeType == xml.dom.minidom.Node.DOCUMENT_NODE:
-    for i in range(level):
-      print(' ', end='')
-    print(node.nodeName)
-    for child in node.childNodes:
-      print_node(child, level + 1)
-  else:
-    for i in range(level):
-      print('.', end='')
-    print(node.nodeValue)
+  for (n, entering) in walk(node):
+    if not entering:
+      level -= 1
+      continue
+    if n.nodeType in _tag_types:
+      print(' ' * level + n.nodeName)
+    else:
+      print('.' * level + str(n.nodeValue))
+    level += 1
 
 def merge_text_nodes2(doc, node):
-  i = 0
-  while i < node.childNodes.length - 1:
-    c1 = node.childNodes.item(i)
-    c2 = node.childNodes.item(i + 1)
-    if c1.nodeType == xml.dom.minidom.Node.TEXT_NODE and c2.nodeType == xml.dom.minidom.Node.TEXT_NODE:
-      node.replaceChild(doc.createTextNode(c1.nodeValue + c2.nodeValue), c1)
-      node.removeChild(c2).unlink()
+  # Children of a node are merged when it is entered, before they are visited
+  for (n, entering) in walk(node):
+    if not entering:
       continue
-    i = i + 1
-  for c in node.childNodes:
-    merge_text_nodes2(doc, c)
+    i = 0
+    while i < n.childNodes.length - 1:
+      c1 = n.childNodes.item(i)
+      c2 = n.childNodes.item(i + 1)
+      if c1.nodeType == xml.dom.minidom.Node.TEXT_NODE and c2.nodeType == xml.dom.minidom.Node.TEXT_NODE:
+        n.replaceChild(doc.createTextNode(c1.nodeValue + c2.nodeValue), c1)
+        n.removeChild(c2).unlink()
+        continue
+      i = i + 1
 
 def merge_text_nodes(doc):
   """Merge consecutive text nodes in a DOM tree. Assume that the current node is an element or a document"""
@@ -314,28 +938,32 @@ def get_text_from_subtree(node):
   to generate merged text inside a <p> tag.
   Useless tags as script, style, ... are ignored.
   """
-  txt = ""
-  
-  for n in node.childNodes:
+  parts = []
+
+  for (n, entering) in walk(node):
+    if not entering or n is node:
+      continue
     if n.nodeType == xml.dom.minidom.Node.TEXT_NODE:
       # We want real content text, no script junk
-      if not filter_useless_tags( node.nodeName ):
-        txt += n.nodeValue
+      if not filter_useless_tags( n.parentNode.nodeName ):
+        parts.append(n.nodeValue)
     else:
-        txt += ' ' + get_text_from_subtree( n )
+      parts.append(' ')
 
-  return txt
+  return "".join(parts)
   
-def clean_html(html):
+def clean_html(html, parser = None):
   """
   Takes a raw html string, and converts it into a good html string, 
   well encoded.
+  *parser* is an html5lib parser building dom trees, which may be reused between pages.
   """
-  p = html5lib.HTMLParser(tree=html5lib.treebuilders.getTreeBuilder("dom"))
-  doc = p.parse( html )
+  if parser is None:
+    parser = html5lib.HTMLParser(tree=html5lib.treebuilders.getTreeBuilder("dom"))
+  doc = parser.parse( html )
 
-  walker = html5lib.treewalkers.getTreeWalker("dom")
-  stream = walker(doc)
+  # getTreeWalker("dom") relies on an implicit relative import, which python 3 lacks
+  stream = html5lib.treewalkers.dom.TreeWalker(doc)
   s = html5lib.serializer.XHTMLSerializer(omit_optional_tags=False)
   output_generator = s.serialize(stream)
 
@@ -345,3 +973,11 @@ def clean_html(html):
 
   return str
 
+def clean_html_many(htmls, pool=None):
+  """
+  Cleans several raw html strings (see clean_html), and yields them in order.
+  With a parse_pool.ParsePool, pages are cleaned in parallel by its worker processes.
+  """
+  if pool is None:
+    return map( clean_html, htmls )
+  return pool.clean_html_many( htmls )
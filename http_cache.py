@@ -0,0 +1,167 @@
+# -*- coding: utf8 -*-
+
+import collections, hashlib, json, os, threading
+
+__author__ = "glebourgeois@me.com"
+
+class HTTPCache:
+  """
+  On-disk cache of response bodies, used by Fetcher to revalidate pages
+  with If-None-Match / If-Modified-Since instead of fetching them again.
+
+  Bodies are stored once, in a content-addressed layout (objects/ab/cdef...,
+  named after their sha1), so that urls serving the same content share it.
+  An index maps each url to its body digest, ETag and Last-Modified headers.
+  When the stored bodies exceed max_size bytes, least recently used urls are evicted.
+  """
+
+  def __init__(self, directory, max_size=100 * 1024 * 1024, save_every=50):
+    """
+    :param directory: Directory where the cache is stored, created if needed
+    :param max_size: Maximum size of stored bodies, in bytes
+    :param save_every: The index is written to disk every save_every stores (and by save/close)
+    """
+    self.directory = directory
+    self.max_size = max_size
+    self.save_every = save_every
+
+    self.hits = 0
+    self.misses = 0
+
+    self._lock = threading.RLock()
+    self._dirty = 0
+    self._index = collections.OrderedDict() # url -> entry, least recently used first
+    self._refs = {} # digest -> (number of urls, size)
+    self.size = 0
+
+    os.makedirs( os.path.join(directory, "objects"), exist_ok=True )
+    self._load_index()
+
+  def conditional_headers(self, url):
+    """
+    Returns headers to send to revalidate the cached version of url.
+    """
+    with self._lock:
+      entry = self._index.get( url )
+      if entry is None:
+        return {}
+      headers = {}
+      if entry["etag"] is not None:
+        headers["If-None-Match"] = entry["etag"]
+      if entry["last_modified"] is not None:
+        headers["If-Modified-Since"] = entry["last_modified"]
+      return headers
+
+  def load(self, url):
+    """
+    Returns the cached body of url, or None if it is not cached.
+    """
+    with self._lock:
+      entry = self._index.get( url )
+      if entry is None:
+        self.misses += 1
+        return None
+      self._index.move_to_end( url )
+      path = self._object_path( entry["digest"] )
+
+    try:
+      with open(path, "rb") as f:
+        body = f.read()
+    except OSError:
+      with self._lock:
+        self._remove( url )
+        self.misses += 1
+      return None
+
+    with self._lock:
+      self.hits += 1
+    return body
+
+  def store(self, url, body, headers):
+    """
+    Stores the body of url, if its headers allow a later revalidation
+    (an ETag or a Last-Modified header).
+    """
+    etag = headers.get("ETag")
+    last_modified = headers.get("Last-Modified")
+    if etag is None and last_modified is None:
+      return
+    if len(body) > self.max_size:
+      return
+
+    digest = hashlib.sha1( body ).hexdigest()
+    path = self._object_path( digest )
+    if not os.path.exists( path ):
+      os.makedirs( os.path.dirname(path), exist_ok=True )
+      tmp = "%s.%d.tmp" % (path, threading.get_ident())
+      with open(tmp, "wb") as f:
+        f.write( body )
+      os.replace( tmp, path )
+
+    with self._lock:
+      if url in self._index:
+        self._remove( url )
+      self._index[url] = {"digest": digest, "etag": etag, "last_modified": last_modified}
+      self._ref( digest, len(body) )
+      self._evict()
+
+      self._dirty += 1
+      if self._dirty >= self.save_every:
+        self.save()
+
+  def save(self):
+    """
+    Writes the index to disk.
+    """
+    with self._lock:
+      path = os.path.join( self.directory, "index.json" )
+      with open(path + ".tmp", "w") as f:
+        json.dump( [[url, entry] for url, entry in self._index.items()], f )
+      os.replace( path + ".tmp", path )
+      self._dirty = 0
+
+  def close(self):
+    self.save()
+
+  def _load_index(self):
+    path = os.path.join( self.directory, "index.json" )
+    if not os.path.exists( path ):
+      return
+    with open(path) as f:
+      for url, entry in json.load( f ):
+        try:
+          size = os.path.getsize( self._object_path(entry["digest"]) )
+        except OSError:
+          continue
+        self._index[url] = entry
+        self._ref( entry["digest"], size )
+
+  def _object_path(self, digest):
+    return os.path.join( self.directory, "objects", digest[:2], digest[2:] )
+
+  def _ref(self, digest, size):
+    count, size = self._refs.get( digest, (0, size) )
+    if count == 0:
+      self.size += size
+    self._refs[digest] = (count + 1, size)
+
+  def _remove(self, url):
+    """
+    Removes url from the index, and deletes its body if no other url uses it.
+    """
+    digest = self._index.pop( url )["digest"]
+    count, size = self._refs[digest]
+    if count > 1:
+      self._refs[digest] = (count - 1, size)
+      return
+    del self._refs[digest]
+    self.size -= size
+    try:
+      os.remove( self._object_path(digest) )
+    except OSError:
+      pass
+
+  def _evict(self):
+    while self.size > self.max_size and len(self._index) > 0:
+      url = next( iter(self._index) )
+      self._remove( url )
@@ -0,0 +1,116 @@
+# -*- coding: utf8 -*-
+
+import collections, threading, time
+
+__author__ = "glebourgeois@me.com"
+
+# Stages of a request, in the order they happen
+STAGES = ("dns", "connect", "first_byte", "transfer", "decode", "parse")
+
+def timed(function, *args):
+  """
+  Calls function with args, and returns (result, number of seconds it took).
+  It is a module function, so that it can be run by worker processes too.
+  """
+  start = time.perf_counter()
+  result = function( *args )
+  return (result, time.perf_counter() - start)
+
+
+class Metrics:
+  """
+  Thread safe collector of crawl metrics : time spent in each stage of requests
+  (dns, connect, first_byte, transfer, decode, parse), counters (bytes, requests...),
+  a histogram of status codes, and gauges (queue depths).
+  Every event is also given to hook, if any, so that metrics may be sent elsewhere.
+  When report_every is given, a summary is reported periodically.
+  """
+
+  def __init__(self, hook=None, report_every=None, report=print):
+    """
+    :param hook: Optional function called with (kind, name, value, url) for each event,
+      kind being "timing", "count", "status" or "gauge" (url may be None)
+    :param report_every: Number of seconds between two summaries, None for no periodic summary
+    :param report: Function given the text of periodic summaries
+    """
+    self.hook = hook
+    self.report_every = report_every
+    self.report = report
+
+    self.timings = {} # stage -> [count, total seconds, max seconds]
+    self.counters = collections.Counter()
+    self.statuses = collections.Counter()
+    self.gauges = {}
+
+    self._lock = threading.Lock()
+    self._start = time.time()
+    self._reported = self._start
+
+  def timing(self, stage, seconds, url=None):
+    """
+    Records that stage of a request took seconds.
+    """
+    with self._lock:
+      entry = self.timings.setdefault( stage, [0, 0.0, 0.0] )
+      entry[0] += 1
+      entry[1] += seconds
+      entry[2] = max( entry[2], seconds )
+    if self.hook is not None:
+      self.hook( "timing", stage, seconds, url )
+
+  def count(self, name, value=1, url=None):
+    with self._lock:
+      self.counters[name] += value
+    if self.hook is not None:
+      self.hook( "count", name, value, url )
+
+  def status(self, code, url=None):
+    """
+    Records the status code of a response (or the name of the error which prevented it).
+    """
+    with self._lock:
+      self.statuses[code] += 1
+    if self.hook is not None:
+      self.hook( "status", code, 1, url )
+
+  def gauge(self, name, value):
+    """
+    Records the current value of name (a queue depth, for instance).
+    """
+    with self._lock:
+      self.gauges[name] = value
+    if self.hook is not None:
+      self.hook( "gauge", name, value, None )
+
+  def summary(self):
+    """
+    Returns a text summary of metrics collected so far.
+    """
+    with self._lock:
+      elapsed = max( time.time() - self._start, 1e-6 )
+      lines = ["%d requests in %.1fs (%.1f/s), %d bytes (%.0f bytes/s)" %
+               (self.counters["requests"], elapsed, self.counters["requests"] / elapsed,
+                self.counters["bytes"], self.counters["bytes"] / elapsed)]
+      for stage in STAGES + tuple( sorted( set(self.timings) - set(STAGES) ) ):
+        if stage in self.timings:
+          count, total, longest = self.timings[stage]
+          lines.append( "  %-10s count %6d  total %8.2fs  mean %7.1fms  max %7.1fms" %
+                        (stage, count, total, 1000 * total / count, 1000 * longest) )
+      if len(self.statuses) > 0:
+        lines.append( "  status " + ", ".join( "%s: %d" % (code, n) for code, n in sorted( self.statuses.items(), key=lambda s: str(s[0]) ) ) )
+      if len(self.gauges) > 0:
+        lines.append( "  queues " + ", ".join( "%s: %s" % g for g in sorted( self.gauges.items() ) ) )
+    return "\n".join( lines )
+
+  def maybe_report(self):
+    """
+    Reports a summary if report_every seconds passed since the last one.
+    """
+    if self.report_every is None:
+      return
+    now = time.time()
+    with self._lock:
+      if now - self._reported < self.report_every:
+        return
+      self._reported = now
+    self.report( self.summary() )
@@ -0,0 +1,88 @@
+# -*- coding: utf8 -*-
+
+import hashlib, os, threading
+
+__author__ = "glebourgeois@me.com"
+
+class PageStore:
+  """
+  Dictionary-like store of crawled pages (url -> html code), which writes
+  each page to its own file instead of keeping it in memory.
+  An index file lists stored urls, so that a store can be reopened, or
+  walked page by page.
+  """
+
+  def __init__(self, directory):
+    """
+    :param directory: Directory where pages are stored, created if needed
+    """
+    self.directory = directory
+    self._lock = threading.Lock()
+    os.makedirs( os.path.join(directory, "pages"), exist_ok=True )
+
+    self._count = 0
+    for url in self:
+      self._count += 1
+
+    self._index = open( os.path.join(directory, "index.txt"), "a", encoding="utf-8" )
+
+  def path(self, url):
+    """
+    Returns the path of the file storing url.
+    """
+    digest = hashlib.sha1( url.encode("utf-8") ).hexdigest()
+    return os.path.join( self.directory, "pages", digest[:2], digest[2:] )
+
+  def __setitem__(self, url, html):
+    path = self.path( url )
+    with self._lock:
+      known = os.path.exists( path )
+      os.makedirs( os.path.dirname(path), exist_ok=True )
+      with open(path, "wb") as f:
+        f.write( html )
+      if not known:
+        self._index.write( url + "\n" )
+        self._index.flush()
+        self._count += 1
+
+  def __getitem__(self, url):
+    try:
+      with open(self.path( url ), "rb") as f:
+        return f.read()
+    except OSError:
+      raise KeyError( url )
+
+  def get(self, url, default=None):
+    try:
+      return self[url]
+    except KeyError:
+      return default
+
+  def __contains__(self, url):
+    return os.path.exists( self.path( url ) )
+
+  def __iter__(self):
+    path = os.path.join( self.directory, "index.txt" )
+    if not os.path.exists( path ):
+      return
+    with open(path, encoding="utf-8") as f:
+      for line in f:
+        url = line.rstrip("\n")
+        if len(url) > 0:
+          yield url
+
+  def keys(self):
+    return iter( self )
+
+  def items(self):
+    """
+    Yields (url, html) tuples, reading pages one at a time.
+    """
+    for url in self:
+      yield (url, self[url])
+
+  def __len__(self):
+    return self._count
+
+  def close(self):
+    self._index.close()
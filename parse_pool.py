@@ -0,0 +1,128 @@
+# -*- coding: utf8 -*-
+
+import concurrent.futures, itertools, threading
+
+import html5lib
+
+from Pywemil import html5wrapper
+from Pywemil.dedup import simhash
+
+__author__ = "glebourgeois@me.com"
+
+# Functions below run in worker processes : they take raw html bytes, and
+# return compact results, cheap to send back to the parent process.
+
+# Parser of each thread : a single one in worker processes, built when they start
+_local = threading.local()
+
+def _dom_parser():
+  parser = getattr( _local, "parser", None )
+  if parser is None:
+    parser = html5lib.HTMLParser(tree=html5lib.treebuilders.getTreeBuilder("dom"))
+    _local.parser = parser
+  return parser
+
+def _init_worker():
+  # Loading the parser once, and reusing it for every page of the worker
+  _dom_parser()
+
+def parse_links(html, fast=True):
+  """
+  Returns the list of links of a raw page (see html5wrapper.extract_links and extract_doc_links).
+  """
+  if fast:
+    return html5wrapper.extract_links( html, base=True )
+  return list( html5wrapper.extract_doc_links( _dom_parser().parse( html ) ).keys() )
+
+def parse_page(html, fast=True, bits=64):
+  """
+  Returns (links, fingerprint) of a raw page : its links (see parse_links), and the
+  SimHash of its text (see dedup.simhash), used to detect near-duplicate pages.
+  """
+  if fast:
+    links, text = html5wrapper.extract_links_and_text( html, base=True )
+  else:
+    dom = _dom_parser().parse( html )
+    links = list( html5wrapper.extract_doc_links( dom ).keys() )
+    text = html5wrapper.get_text_from_subtree( dom )
+  return (links, simhash( text, bits ))
+
+def parse_text(html):
+  """
+  Returns the text of a raw page, without script and style junk.
+  """
+  return html5wrapper.get_text_from_subtree( _dom_parser().parse( html ) )
+
+def clean_page(html):
+  """
+  Returns the cleaned version of a raw page (see html5wrapper.clean_html).
+  """
+  return html5wrapper.clean_html( html, _dom_parser() )
+
+
+class ParsePool:
+  """
+  Pool of long-lived worker processes parsing raw pages, so that html5lib parsing
+  (pure python, thus CPU bound) scales with the number of cores.
+  Pages are shipped as raw bytes, and only links, cleaned html or text come back.
+  """
+
+  def __init__(self, processes=None):
+    """
+    :param processes: Number of worker processes, the number of cores if None
+    """
+    self._executor = concurrent.futures.ProcessPoolExecutor( processes, initializer=_init_worker )
+
+  def submit_links(self, html, fast=True):
+    """
+    Returns a future of the list of links of html (see parse_links).
+    """
+    return self._executor.submit( parse_links, html, fast )
+
+  def submit_page(self, html, fast=True, bits=64):
+    """
+    Returns a future of the (links, fingerprint) tuple of html (see parse_page).
+    """
+    return self._executor.submit( parse_page, html, fast, bits )
+
+  def submit(self, function, *args):
+    """
+    Returns a future of function(*args) run by a worker process (function must be picklable).
+    """
+    return self._executor.submit( function, *args )
+
+  def links(self, html, fast=True):
+    return self.submit_links( html, fast ).result()
+
+  def clean_html(self, html):
+    return self._executor.submit( clean_page, html ).result()
+
+  def text(self, html):
+    return self._executor.submit( parse_text, html ).result()
+
+  def links_many(self, htmls, fast=True, chunksize=4):
+    """
+    Yields the list of links of each page of htmls, in order.
+    """
+    return self._executor.map( parse_links, htmls, itertools.repeat( fast ), chunksize=chunksize )
+
+  def clean_html_many(self, htmls, chunksize=4):
+    """
+    Yields the cleaned version of each page of htmls, in order (see html5wrapper.clean_html).
+    """
+    return self._executor.map( clean_page, htmls, chunksize=chunksize )
+
+  def text_many(self, htmls, chunksize=4):
+    """
+    Yields the text of each page of htmls, in order.
+    """
+    return self._executor.map( parse_text, htmls, chunksize=chunksize )
+
+  def close(self):
+    self._executor.shutdown()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
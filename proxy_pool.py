@@ -0,0 +1,161 @@
+# -*- coding: utf8 -*-
+
+import random, threading, time, urllib.error, http.client
+
+__author__ = "glebourgeois@me.com"
+
+# Answers telling that the proxy itself failed, rather than the requested site
+PROXY_ERROR_CODES = set( [407, 502, 504] )
+
+def is_proxy_failure(error):
+  """
+  Tells if a request failed because of its proxy (network error, proxy error answer).
+  """
+  if isinstance(error, urllib.error.HTTPError):
+    return error.code in PROXY_ERROR_CODES
+  return isinstance(error, (OSError, http.client.HTTPException))
+
+
+class ProxyStats:
+  """
+  Health of a proxy : smoothed latency and error rate, requests in flight,
+  and ejection state.
+  """
+
+  def __init__(self, proxy):
+    self.proxy = proxy
+    self.latency = None # smoothed number of seconds to get response headers
+    self.error_rate = 0.0
+    self.inflight = 0
+    self.failures = 0 # consecutive failures
+    self.ejected_until = None
+    self.requests = 0
+
+  def score(self):
+    """
+    Expected cost of a request through this proxy : lower is better.
+    """
+    latency = self.latency if self.latency is not None else 0.0
+    return (latency + 0.05) * (1 + self.inflight) / max( 0.05, 1 - self.error_rate )
+
+
+class ProxyPool:
+  """
+  Fleet of proxies, which a Fetcher spreads its requests on (Fetcher(proxy=ProxyPool(...))).
+  Each request goes to the better of two randomly chosen healthy proxies, judged on their
+  smoothed latency, error rate and requests in flight. A proxy failing eject_after times
+  in a row is not used for eject_for seconds. With pin_hosts, all requests to a host
+  go through the same proxy (for sites tying sessions to an IP address), as long as it is healthy.
+  Both http and https requests are proxied (https ones through a CONNECT tunnel).
+  """
+
+  def __init__(self, proxies, pin_hosts=False, eject_after=3, eject_for=300, smoothing=0.3):
+    """
+    :param proxies: List of proxies, under the form IP:PORT
+    :param pin_hosts: If True, requests to a host always use the same proxy
+    :param eject_after: Number of consecutive failures after which a proxy is ejected
+    :param eject_for: Number of seconds during which an ejected proxy is not used
+    :param smoothing: Weight of the last request in smoothed latency and error rate
+    """
+    self.pin_hosts = pin_hosts
+    self.eject_after = eject_after
+    self.eject_for = eject_for
+    self.smoothing = smoothing
+
+    self._stats = {} # proxy -> ProxyStats
+    self._pins = {}  # host -> proxy
+    self._lock = threading.Lock()
+    for proxy in proxies:
+      self.add( proxy )
+
+  def add(self, proxy):
+    with self._lock:
+      self._stats.setdefault( proxy, ProxyStats( proxy ) )
+
+  def remove(self, proxy):
+    with self._lock:
+      self._stats.pop( proxy, None )
+      for host in [h for h, p in self._pins.items() if p == proxy]:
+        del self._pins[host]
+
+  def _healthy(self, now):
+    healthy = []
+    for stats in self._stats.values():
+      if stats.ejected_until is not None and stats.ejected_until <= now:
+        # Ejection is over : the proxy gets another chance
+        stats.ejected_until = None
+        stats.failures = 0
+        stats.error_rate = 0.5
+      if stats.ejected_until is None:
+        healthy.append( stats )
+    return healthy
+
+  def healthy(self):
+    """
+    Returns the list of proxies which are not ejected.
+    """
+    with self._lock:
+      return [s.proxy for s in self._healthy( time.time() )]
+
+  def acquire(self, host=None):
+    """
+    Chooses the proxy of a request to host, and counts it as in flight until release.
+    Raises IOError if the pool is empty.
+    """
+    with self._lock:
+      if len(self._stats) == 0:
+        raise IOError("No proxy in the pool")
+      healthy = self._healthy( time.time() )
+      if len(healthy) == 0:
+        # Every proxy is ejected : the one coming back first is used anyway
+        healthy = [min( self._stats.values(), key=lambda s: s.ejected_until )]
+
+      stats = None
+      if self.pin_hosts and host is not None:
+        pinned = self._stats.get( self._pins.get( host ) )
+        if pinned is not None and pinned in healthy:
+          stats = pinned
+      if stats is None:
+        candidates = random.sample( healthy, min( 2, len(healthy) ) )
+        stats = min( candidates, key=ProxyStats.score )
+        if self.pin_hosts and host is not None:
+          self._pins[host] = stats.proxy
+
+      stats.inflight += 1
+      stats.requests += 1
+      return stats.proxy
+
+  def release(self, proxy, seconds=None, failed=False):
+    """
+    Records the outcome of a request sent through proxy : seconds it took to get
+    response headers, or its failure.
+    """
+    with self._lock:
+      stats = self._stats.get( proxy )
+      if stats is None:
+        return
+      stats.inflight = max( 0, stats.inflight - 1 )
+      stats.error_rate += self.smoothing * ((1.0 if failed else 0.0) - stats.error_rate)
+      if failed:
+        stats.failures += 1
+        if stats.failures >= self.eject_after:
+          stats.ejected_until = time.time() + self.eject_for
+        return
+      stats.failures = 0
+      if seconds is not None:
+        if stats.latency is None:
+          stats.latency = seconds
+        else:
+          stats.latency += self.smoothing * (seconds - stats.latency)
+
+  def stats(self):
+    """
+    Returns a dictionary of proxy -> (smoothed latency, error rate, requests, ejected).
+    """
+    with self._lock:
+      now = time.time()
+      return dict( (s.proxy, (s.latency, s.error_rate, s.requests, s.ejected_until is not None and s.ejected_until > now))
+                   for s in self._stats.values() )
+
+  def __len__(self):
+    return len( self._stats )
@@ -0,0 +1,120 @@
+# -*- coding: utf8 -*-
+
+import email.message, io, threading, time, urllib.error
+
+from Pywemil.urlnorm import canonicalize_url
+
+__author__ = "glebourgeois@me.com"
+
+class ReplayResponse:
+  """
+  A recorded response, with the interface of connection_pool.PooledResponse.
+  Its body is delayed according to the bandwidth of the pool which served it.
+  """
+
+  def __init__(self, url, status, reason, headers, body, bandwidth=None, method="GET", request_headers=None):
+    self.url = url
+    self.status = status
+    self.reason = reason
+    self.headers = headers
+    self.method = method
+    self.request_headers = request_headers or {}
+    self.bandwidth = bandwidth
+    self._body = io.BytesIO( body )
+
+  def read(self, amt=None):
+    data = self._body.read( amt )
+    if self.bandwidth is not None and len(data) > 0:
+      time.sleep( len(data) / float( self.bandwidth ) )
+    return data
+
+  def geturl(self):
+    return self.url
+
+  def getcode(self):
+    return self.status
+
+  def info(self):
+    return self.headers
+
+  def close(self):
+    pass
+
+
+class ReplayPool:
+  """
+  Replaces a connection_pool.ConnectionPool, serving responses recorded in a store
+  instead of requesting the network : a Fetcher built with a ReplayPool crawls and
+  scrapes an archive offline, which makes benchmarks and regression tests reproducible.
+  Urls are looked up by their canonical form. Unknown urls are answered by a 404 error.
+  """
+
+  def __init__(self, source, latency=0, bandwidth=None, canonicalize=canonicalize_url):
+    """
+    :param source: Recorded pages : a warc.WARCReader (status and headers are replayed),
+      a page_store.PageStore or any dictionary of url -> body
+    :param latency: Number of seconds waited before each response, as a network round trip
+    :param bandwidth: Optional number of bytes per second at which bodies are read
+    :param canonicalize: Function giving the key under which urls are looked up (None to use raw urls)
+    """
+    self.source = source
+    self.latency = latency
+    self.bandwidth = bandwidth
+    self.canonicalize = canonicalize
+    # No name is resolved when replaying
+    self.dns = None
+
+    self.served = 0
+    self.missing = 0
+    self._lock = threading.Lock()
+
+    self._keys = {} # canonical url -> key in source
+    for key in source.keys():
+      self._keys[self._canonical( key )] = key
+
+  def _canonical(self, url):
+    if self.canonicalize is None:
+      return url
+    return self.canonicalize( url )
+
+  def _load(self, key):
+    """
+    Returns (status, reason, headers, body) recorded for key.
+    """
+    headers = email.message.Message()
+    if hasattr(self.source, "record"):
+      warc_headers, status, http_headers, body = self.source.record( key )
+      for name, value in http_headers:
+        headers[name] = value
+      return (status or 200, "OK", headers, body)
+    body = self.source[key]
+    headers["Content-Type"] = "text/html"
+    headers["Content-Length"] = str( len(body) )
+    return (200, "OK", headers, body)
+
+  def urlopen(self, url, data=None, headers=None, proxy=None, max_redirects=5, method=None):
+    """
+    Returns the ReplayResponse recorded for url, with the interface of ConnectionPool.urlopen.
+    """
+    if method is None:
+      method = "GET" if data is None else "POST"
+    if self.latency > 0:
+      time.sleep( self.latency )
+
+    key = self._keys.get( self._canonical( url ) )
+    if key is None:
+      with self._lock:
+        self.missing += 1
+      raise urllib.error.HTTPError(url, 404, "Not recorded", email.message.Message(), None)
+
+    status, reason, response_headers, body = self._load( key )
+    with self._lock:
+      self.served += 1
+    if status >= 400:
+      raise urllib.error.HTTPError(url, status, reason, response_headers, None)
+    if method == "HEAD":
+      body = b""
+    return ReplayResponse(url, status, reason, response_headers, body, self.bandwidth, method, headers)
+
+  def close(self):
+    pass
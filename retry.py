@@ -0,0 +1,144 @@
+# -*- coding: utf8 -*-
+
+import http.client, random, socket, threading, time
+import urllib.error
+
+__author__ = "glebourgeois@me.com"
+
+class CircuitOpenError(IOError):
+  """
+  Raised instead of sending a request to a host whose circuit breaker is open.
+  """
+
+  def __init__(self, host, retry_in):
+    IOError.__init__(self, "Circuit open for %s, retry in %.1f seconds" % (host, retry_in))
+    self.host = host
+    self.retry_in = retry_in
+
+
+def is_host_failure(error):
+  """
+  Tells if error means that a host is failing (network errors, 5xx and 429 answers),
+  rather than that a page is missing.
+  """
+  if isinstance(error, urllib.error.HTTPError):
+    return error.code >= 500 or error.code == 429
+  return isinstance(error, (OSError, http.client.HTTPException)) and \
+         not isinstance(error, CircuitOpenError)
+
+
+class RetryPolicy:
+  """
+  Tells which failed requests should be retried, and when :
+  exponential backoff with jitter, only on retryable errors and status codes.
+  Only idempotent requests (GET and HEAD) are retried by default, as retrying a POST
+  may repeat its side effects.
+  """
+
+  def __init__(self, retries=3, backoff=0.5, max_backoff=60, jitter=0.5, statuses=(429, 500, 502, 503, 504), methods=("GET", "HEAD")):
+    """
+    :param retries: Maximum number of retries of a request
+    :param backoff: Delay before the first retry, in seconds, doubled on each retry
+    :param max_backoff: Maximum delay between two tries
+    :param jitter: Delays are multiplied by a random factor between 1 - jitter and 1 + jitter
+    :param statuses: HTTP status codes which may be retried
+    :param methods: HTTP methods of requests which may be retried (add "POST" to retry them too)
+    """
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.jitter = jitter
+    self.statuses = set( statuses )
+    self.methods = set( m.upper() for m in methods )
+
+  def is_retryable(self, error, method="GET"):
+    """
+    Tells if a request with method which failed with error may succeed later, and may be sent again.
+    """
+    if method.upper() not in self.methods:
+      return False
+    if isinstance(error, urllib.error.HTTPError):
+      return error.code in self.statuses
+    if isinstance(error, urllib.error.URLError) and isinstance(error.reason, socket.gaierror):
+      return False
+    if isinstance(error, (socket.gaierror, CircuitOpenError)):
+      return False
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+  def delay(self, attempt, error=None):
+    """
+    Returns the number of seconds to wait before retry number attempt (starting at 0).
+    A Retry-After header given in seconds is honoured.
+    """
+    if isinstance(error, urllib.error.HTTPError) and error.headers is not None:
+      after = error.headers.get("Retry-After")
+      if after is not None and after.strip().isdigit():
+        return min( float( after ), self.max_backoff )
+
+    delay = min( self.backoff * (2 ** attempt), self.max_backoff )
+    return delay * random.uniform( 1 - self.jitter, 1 + self.jitter )
+
+
+class CircuitBreaker:
+  """
+  Per host circuit breaker : after threshold consecutive failures, a host is not
+  requested anymore for cooldown seconds. Then a single trial request is allowed :
+  the circuit is closed again if it succeeds, and reopened if it fails.
+  """
+
+  def __init__(self, threshold=5, cooldown=60):
+    """
+    :param threshold: Number of consecutive failures opening the circuit of a host
+    :param cooldown: Number of seconds during which an open circuit rejects requests
+    """
+    self.threshold = threshold
+    self.cooldown = cooldown
+
+    self._failures = {} # host -> number of consecutive failures
+    self._opened = {}   # host -> time at which the circuit may be tried again
+    self._trials = set() # hosts whose trial request is running
+    self._lock = threading.Lock()
+
+  def retry_in(self, host):
+    """
+    Returns the number of seconds before host may be requested again (0 if it may be now).
+    """
+    with self._lock:
+      if host in self._trials:
+        return self.cooldown
+      until = self._opened.get( host )
+      if until is None:
+        return 0
+      return max( 0, until - time.time() )
+
+  def allow(self, host):
+    """
+    Tells if a request to host may be sent now, and records it as the trial
+    request of a host whose cooldown is over.
+    """
+    with self._lock:
+      until = self._opened.get( host )
+      if until is None:
+        return True
+      if host in self._trials or until > time.time():
+        return False
+      self._trials.add( host )
+      return True
+
+  def success(self, host):
+    with self._lock:
+      self._failures.pop( host, None )
+      self._opened.pop( host, None )
+      self._trials.discard( host )
+
+  def failure(self, host):
+    with self._lock:
+      count = self._failures.get( host, 0 ) + 1
+      self._failures[host] = count
+      if host in self._trials or count >= self.threshold:
+        self._opened[host] = time.time() + self.cooldown
+      self._trials.discard( host )
+
+  def is_open(self, host):
+    with self._lock:
+      return host in self._opened
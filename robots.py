@@ -0,0 +1,89 @@
+# -*- coding: utf8 -*-
+
+import threading, time, urllib.parse, urllib.robotparser
+
+__author__ = "glebourgeois@me.com"
+
+class RobotsCache:
+  """
+  Fetches the robots.txt of each host once, and keeps its rules for ttl seconds.
+  When the fetcher has a scheduler, the Crawl-delay (or Request-rate) of a host
+  becomes its request rate.
+  """
+
+  def __init__(self, fetcher, ttl=3600, user_agent="*"):
+    """
+    :param fetcher: Fetcher used to get robots.txt files
+    :param ttl: Number of seconds during which rules of a host are kept
+    :param user_agent: User agent whose rules are applied
+    """
+    self.fetcher = fetcher
+    self.ttl = ttl
+    self.user_agent = user_agent
+
+    self._rules = {} # (scheme, netloc) -> (RobotFileParser, fetch time)
+    self._locks = {} # (scheme, netloc) -> lock, so that a robots.txt is fetched once
+    self._lock = threading.Lock()
+
+  def rules(self, url):
+    """
+    Returns the RobotFileParser of the host of url, fetching its robots.txt if needed.
+    """
+    parts = urllib.parse.urlsplit( url )
+    key = (parts.scheme, parts.netloc)
+
+    with self._lock:
+      lock = self._locks.setdefault( key, threading.Lock() )
+
+    with lock:
+      entry = self._rules.get( key )
+      if entry is not None and time.time() - entry[1] < self.ttl:
+        return entry[0]
+
+      robots_url = "%s://%s/robots.txt" % key
+      parser = urllib.robotparser.RobotFileParser( robots_url )
+      body = self.fetcher.fetch( robots_url )
+      if body is None:
+        # No robots.txt : everything is allowed
+        parser.parse( [] )
+      else:
+        parser.parse( body.decode("utf-8", "replace").splitlines() )
+      self._rules[key] = (parser, time.time())
+
+      self._apply_delay( parts.hostname, parser )
+      return parser
+
+  def can_fetch(self, url):
+    """
+    Tells if robots.txt rules allow to fetch url.
+    """
+    return self.rules( url ).can_fetch( self.user_agent, url )
+
+  def crawl_delay(self, url):
+    """
+    Returns the number of seconds to wait between two requests to the host of url, or None.
+    """
+    parser = self.rules( url )
+    delay = parser.crawl_delay( self.user_agent )
+    if delay is None:
+      rate = parser.request_rate( self.user_agent )
+      if rate is not None and rate.requests > 0:
+        delay = rate.seconds / rate.requests
+    return float( delay ) if delay is not None else None
+
+  def sitemaps(self, url):
+    """
+    Returns the sitemaps listed by the robots.txt of the host of url.
+    """
+    return self.rules( url ).site_maps() or []
+
+  def _apply_delay(self, host, parser):
+    scheduler = getattr( self.fetcher, "scheduler", None )
+    if scheduler is None:
+      return
+    delay = parser.crawl_delay( self.user_agent )
+    rate = parser.request_rate( self.user_agent )
+    if delay is not None and float( delay ) > 0:
+      scheduler.set_rate( host, 1.0 / float( delay ) )
+    elif rate is not None and rate.seconds > 0:
+      scheduler.set_rate( host, float( rate.requests ) / rate.seconds )
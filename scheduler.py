@@ -0,0 +1,132 @@
+# -*- coding: utf8 -*-
+
+import contextlib, threading, time
+
+__author__ = "glebourgeois@me.com"
+
+class TokenBucket:
+  """
+  A bucket holding at most burst tokens, refilled at rate tokens per second.
+  Each request consumes a token.
+  """
+
+  def __init__(self, rate, burst=1):
+    self.rate = float( rate )
+    self.burst = burst
+    self.tokens = float( burst )
+    self.last = time.time()
+
+  def refill(self, now):
+    self.tokens = min( self.burst, self.tokens + (now - self.last) * self.rate )
+    self.last = now
+
+  def delay(self, now):
+    """
+    Returns the number of seconds to wait before a token is available.
+    """
+    self.refill( now )
+    if self.tokens >= 1:
+      return 0.0
+    return (1 - self.tokens) / self.rate
+
+  def consume(self):
+    self.tokens -= 1
+
+
+class HostScheduler:
+  """
+  Politeness scheduler : enforces, for each host, a request rate (using a token bucket)
+  and a maximum number of concurrent requests.
+  It is thread safe, and may be shared by several fetchers.
+  """
+
+  def __init__(self, rate=1.0, burst=1, max_per_host=2):
+    """
+    :param rate: Default number of requests per second allowed for a host
+    :param burst: Default number of requests which may be sent at once to an idle host
+    :param max_per_host: Maximum number of requests running at the same time on a host
+    """
+    self.rate = rate
+    self.burst = burst
+    self.max_per_host = max_per_host
+
+    self._buckets = {} # host -> TokenBucket
+    self._active = {}  # host -> number of running requests
+    self._cond = threading.Condition()
+    self._local = threading.local()
+
+  def set_rate(self, host, rate, burst=None):
+    """
+    Sets a specific request rate for host (in requests per second).
+    """
+    with self._cond:
+      self._buckets[host] = TokenBucket( rate, burst or self.burst )
+      self._cond.notify_all()
+
+  def ready_in(self, host):
+    """
+    Returns the number of seconds before a request to host may start,
+    or None if the host has reached its maximum number of concurrent requests.
+    """
+    with self._cond:
+      return self._ready_in( host, time.time() )
+
+  def acquire(self, host, block=True):
+    """
+    Waits until a request to host may start, and records it as running.
+    If block is False, returns False instead of waiting.
+    """
+    with self._cond:
+      while True:
+        delay = self._ready_in( host, time.time() )
+        if delay == 0:
+          self._bucket( host ).consume()
+          self._active[host] = self._active.get( host, 0 ) + 1
+          return True
+        if not block:
+          return False
+        self._cond.wait( delay )
+
+  def release(self, host):
+    """
+    Records the end of a request to host.
+    """
+    with self._cond:
+      self._active[host] -= 1
+      if self._active[host] == 0:
+        del self._active[host]
+      self._cond.notify_all()
+
+  @contextlib.contextmanager
+  def request(self, host, acquired=False):
+    """
+    Context manager surrounding a request to host.
+    If acquired is True, the caller has already called acquire for host.
+    Nested requests to the same host in a same thread are not counted twice.
+    """
+    held = getattr( self._local, "held", set() )
+    self._local.held = held
+    if host in held:
+      yield
+      return
+
+    if not acquired:
+      self.acquire( host )
+    held.add( host )
+    try:
+      yield
+    finally:
+      held.discard( host )
+      self.release( host )
+
+  def _bucket(self, host):
+    bucket = self._buckets.get( host )
+    if bucket is None:
+      bucket = TokenBucket( self.rate, self.burst )
+      self._buckets[host] = bucket
+    return bucket
+
+  def _ready_in(self, host, now):
+    if self._active.get( host, 0 ) >= self.max_per_host:
+      return None
+    return self._bucket( host ).delay( now )
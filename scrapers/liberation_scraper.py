@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
-import re, time, random
+import re
 from Pywemil.fetcher      import Fetcher
+from Pywemil.retry        import RetryPolicy
+from Pywemil.scheduler    import HostScheduler
 import Pywemil.html5wrapper as html5wrapper
 
 class LiberationScraper:
@@ -9,7 +11,8 @@ class LiberationScraper:
   def __init__(self):
     self.base_url = "http://recherche.liberation.fr/recherche/"
     self.constant_args = "&period=custom&editorial_source=&paper_channel=&sort=-publication_date_time"
-    self.fetcher = Fetcher()
+    # Courtoisy : no more than one request every 2 seconds on each host
+    self.fetcher = Fetcher(scheduler=HostScheduler(rate=0.5, max_per_host=1), retry=RetryPolicy(retries=2, backoff=3))
     
     # Computed
     self.authors = {} # name associated with a number of articles
@@ -39,15 +42,11 @@ class LiberationScraper:
       
       # fetching page
       page = None
+      # the fetcher retries by itself
       page = self.fetcher.fetch(query)
       if page is None:
-        # Let's try again
-        time.sleep(3)
-        page = self.fetcher.fetch(query)
-        
-        if page is None:
-          print( "Impossible to fetch [%s]" % query )
-          break
+        print( "Impossible to fetch [%s]" % query )
+        break
       
       page = html5wrapper.clean_html( page )
       
@@ -65,8 +64,7 @@ class LiberationScraper:
       self.links.extend( links )
      
       for l in links:
-        # Let's now extract text from each article, with some courtoisy
-        time.sleep( random.uniform(1, 3) )
+        # Let's now extract text from each article, the scheduler handles courtoisy
         p = self.fetcher.fetch( l )
         if p is not None:
           p = html5wrapper.clean_html( p )
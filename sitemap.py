@@ -0,0 +1,79 @@
+# -*- coding: utf8 -*-
+
+import xml.etree.ElementTree as ElementTree
+
+from Pywemil.compression import Decoder
+
+__author__ = "glebourgeois@me.com"
+
+def _local_name(tag):
+  # Removing the xml namespace : {http://www.sitemaps.org/schemas/sitemap/0.9}loc -> loc
+  return tag.rsplit("}", 1)[-1]
+
+def _decoded(chunks):
+  """
+  Yields chunks, decoded block by block if they are gzip compressed.
+  """
+  decoder = None
+  first = True
+  for chunk in chunks:
+    if first:
+      first = False
+      if chunk[:2] == b"\x1f\x8b":
+        decoder = Decoder("gzip")
+    if decoder is None:
+      yield chunk
+    else:
+      for block in decoder.iter_decode( chunk ):
+        yield block
+  if decoder is not None:
+    yield decoder.flush()
+
+def parse_sitemap(chunks):
+  """
+  Parses a sitemap or a sitemap index given as an iterable of raw byte chunks
+  (gzip compressed or not), without loading it entirely in memory.
+  Yields ("url", location) for pages, and ("sitemap", location) for sitemaps listed by an index.
+  """
+  parser = ElementTree.XMLPullParser( events=("start", "end") )
+  root = None
+
+  for chunk in _decoded( chunks ):
+    parser.feed( chunk )
+
+    for event, elem in parser.read_events():
+      if event == "start":
+        if root is None:
+          root = elem
+        continue
+      name = _local_name( elem.tag )
+      if name in ("url", "sitemap"):
+        for child in elem:
+          if _local_name( child.tag ) == "loc" and child.text:
+            yield (name, child.text.strip())
+        # Forgetting parsed entries, so that memory does not grow with the sitemap
+        root.clear()
+
+  parser.close()
+
+def iter_sitemap(fetcher, url, max_depth=2, debug=False):
+  """
+  Yields urls of pages listed by the sitemap at url, following sitemap indexes
+  until max_depth. Sitemaps are streamed from the network and parsed incrementally.
+  """
+  sitemaps = []
+  try:
+    for kind, location in parse_sitemap( fetcher.iter_content( url, debug ) ):
+      if kind == "url":
+        yield location
+      else:
+        sitemaps.append( location )
+  except Exception as e:
+    if debug:
+      print(("Couldn't read sitemap %s" % url))
+      print(e)
+
+  if max_depth > 0:
+    for location in sitemaps:
+      for page in iter_sitemap( fetcher, location, max_depth - 1, debug ):
+        yield page
@@ -0,0 +1,18 @@
+# -*- coding: utf8 -*-
+
+import importlib.util, os, sys
+
+__author__ = "glebourgeois@me.com"
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+# Modules import the bundled html5lib, and the package as Pywemil
+sys.path.insert( 0, os.path.join( ROOT, "html5lib", "src" ) )
+try:
+  import Pywemil
+except ImportError:
+  spec = importlib.util.spec_from_file_location( "Pywemil", os.path.join( ROOT, "__init__.py" ),
+                                                 submodule_search_locations=[ROOT] )
+  module = importlib.util.module_from_spec( spec )
+  sys.modules["Pywemil"] = module
+  spec.loader.exec_module( module )
@@ -0,0 +1,162 @@
+# -*- coding: utf8 -*-
+
+import asyncio, gzip, os, tempfile, unittest
+
+from Pywemil.async_fetcher import AsyncFetcher
+
+__author__ = "glebourgeois@me.com"
+
+class LocalServer:
+  """
+  Local asyncio HTTP/1.1 server, keeping connections alive.
+  routes maps a path to (status, headers, body parts, seconds waited before each part).
+  """
+
+  def __init__(self, routes):
+    self.routes = routes
+    self.connections = 0
+    self.requests = []
+
+  async def start(self):
+    self._server = await asyncio.start_server( self._handle, "127.0.0.1", 0 )
+    self.base = "http://127.0.0.1:%d" % self._server.sockets[0].getsockname()[1]
+    return self
+
+  async def close(self):
+    self._server.close()
+    await self._server.wait_closed()
+
+  async def _handle(self, reader, writer):
+    self.connections += 1
+    try:
+      while True:
+        line = await reader.readline()
+        if not line:
+          break
+        method, path = line.decode("latin-1").split(" ")[:2]
+        while await reader.readline() not in (b"\r\n", b""):
+          pass
+        self.requests.append( (method, path) )
+
+        status, headers, parts, delay = self.routes.get( path, (404, {}, [b"not found"], 0) )
+        head = "HTTP/1.1 %d X\r\nContent-Length: %d\r\n" % (status, sum( len(p) for p in parts ))
+        head += "".join( "%s: %s\r\n" % h for h in headers.items() ) + "\r\n"
+        writer.write( head.encode("latin-1") )
+        for part in parts:
+          if delay:
+            await writer.drain()
+            await asyncio.sleep( delay )
+          writer.write( part )
+        await writer.drain()
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+
+
+def html_page(body):
+  return (200, {"Content-Type": "text/html"}, [body], 0)
+
+def run(test):
+  """
+  Runs coroutine function test with a started server, and closes both the server and the fetcher.
+  """
+  async def main(routes, **fetcher_args):
+    server = await LocalServer( routes ).start()
+    fetcher = AsyncFetcher( **fetcher_args )
+    try:
+      await test( server, fetcher )
+    finally:
+      await fetcher.close()
+      await server.close()
+  return main
+
+
+class AsyncFetcherTest(unittest.TestCase):
+
+  def test_fetch(self):
+    async def test(server, fetcher):
+      html = await fetcher.fetch( server.base + "/page" )
+      self.assertEqual( html, b"<html>hello</html>" )
+      self.assertEqual( fetcher.ok, 1 )
+      self.assertEqual( fetcher.get_current_url(), server.base + "/page" )
+
+      self.assertIsNone( await fetcher.fetch( server.base + "/missing" ) )
+      self.assertEqual( fetcher.notfound, 1 )
+    asyncio.run( run( test )( {"/page": html_page( b"<html>hello</html>" )} ) )
+
+  def test_fetch_decodes_gzip(self):
+    body = b"<html>" + b"compressed " * 1000 + b"</html>"
+    routes = {"/gz": (200, {"Content-Type": "text/html", "Content-Encoding": "gzip"}, [gzip.compress( body )], 0)}
+    async def test(server, fetcher):
+      self.assertEqual( await fetcher.fetch( server.base + "/gz" ), body )
+    asyncio.run( run( test )( routes ) )
+
+  def test_fetch_follows_redirections(self):
+    routes = {"/old": (301, {"Location": "/new"}, [b""], 0), "/new": html_page( b"new" )}
+    async def test(server, fetcher):
+      self.assertEqual( await fetcher.fetch( server.base + "/old" ), b"new" )
+      self.assertEqual( fetcher.get_current_url(), server.base + "/new" )
+    asyncio.run( run( test )( routes ) )
+
+  def test_fetch_many_reuses_connections(self):
+    routes = dict( ("/p%d" % i, html_page( b"page %d" % i )) for i in range(20) )
+    async def test(server, fetcher):
+      results = {}
+      async for url, html in fetcher.fetch_many( [server.base + "/p%d" % i for i in range(20)] + [server.base + "/missing"], concurrency=4 ):
+        results[url] = html
+      self.assertEqual( len(results), 21 )
+      self.assertEqual( results[server.base + "/p7"], b"page 7" )
+      self.assertIsNone( results[server.base + "/missing"] )
+      self.assertEqual( fetcher.ok, 20 )
+      self.assertEqual( fetcher.notfound, 1 )
+      self.assertLessEqual( server.connections, 4 )
+    asyncio.run( run( test )( routes ) )
+
+  def test_html_only_skips_other_contents(self):
+    routes = {"/blob": (200, {"Content-Type": "application/octet-stream"}, [b"\0" * 300000], 0),
+              "/big": html_page( b"x" * 2000 )}
+    async def test(server, fetcher):
+      self.assertIsNone( await fetcher.fetch( server.base + "/blob", html_only=True ) )
+      fetcher.max_html_size = 1000
+      self.assertIsNone( await fetcher.fetch( server.base + "/big", html_only=True ) )
+      self.assertEqual( fetcher.skipped, 2 )
+      self.assertEqual( len( await fetcher.fetch( server.base + "/big" ) ), 2000 )
+    asyncio.run( run( test )( routes ) )
+
+  def test_timeout_applies_to_each_read(self):
+    # The transfer lasts longer than the timeout, but each block comes in time
+    routes = {"/slow": (200, {"Content-Type": "text/html"}, [b"a" * 100] * 4, 0.2),
+              "/stalled": (200, {"Content-Type": "text/html"}, [b"a" * 100], 1.0)}
+    async def test(server, fetcher):
+      self.assertEqual( await fetcher.fetch( server.base + "/slow" ), b"a" * 400 )
+      self.assertIsNone( await fetcher.fetch( server.base + "/stalled" ) )
+    asyncio.run( run( test )( routes, timeout=0.5 ) )
+
+  def test_download(self):
+    routes = {"/file": (200, {}, [b"0123456789"] * 100, 0)}
+    async def test(server, fetcher):
+      with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join( directory, "file" )
+        self.assertEqual( await fetcher.download( server.base + "/file", path ), 1000 )
+        with open(path, "rb") as f:
+          self.assertEqual( f.read(), b"0123456789" * 100 )
+      self.assertEqual( fetcher.ok, 1 )
+    asyncio.run( run( test )( routes ) )
+
+  def test_crawl_domain(self):
+    routes = {
+      "/": html_page( b"<a href='/a'>a</a><a href='/b#top'>b</a><a href='/file.pdf'>f</a><a href='http://other.example/'>o</a>" ),
+      "/a": html_page( b"<a href='/'>home</a><a href='/blob'>blob</a>" ),
+      "/b": html_page( b"b" ),
+      "/blob": (200, {"Content-Type": "application/octet-stream"}, [b"\0" * 1000], 0),
+    }
+    async def test(server, fetcher):
+      pages = await fetcher.crawl_domain( server.base, 2 )
+      self.assertEqual( sorted( pages ), [server.base, server.base + "/a", server.base + "/b"] )
+      self.assertEqual( fetcher.skipped, 1 )
+    asyncio.run( run( test )( routes ) )
+
+
+if __name__ == "__main__":
+  unittest.main()
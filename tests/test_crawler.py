@@ -0,0 +1,75 @@
+# -*- coding: utf8 -*-
+
+import asyncio, http.server, threading, unittest
+
+from Pywemil.async_fetcher import AsyncFetcher
+from Pywemil.fetcher import Fetcher
+from Pywemil.replay import ReplayPool
+
+__author__ = "glebourgeois@me.com"
+
+PAGES = {
+  "/": b"<a href='/a'>a</a><a href='http://127.0.0.1:abc/x'>bad port</a><a href='http://127.0.0.1:99999/'>port out of range</a><a href='http://[::1/'>bad ipv6</a>",
+  "/a": b"<a href='/'>home</a><a href='/b?y=1&amp;x=2'>b</a><a href='/b?x=2&amp;y=1#top'>same b</a>",
+  "/b": b"b",
+}
+
+class Handler(http.server.BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, *args):
+    pass
+
+  def do_GET(self):
+    body = PAGES.get( self.path.split("?")[0] )
+    if body is None:
+      self.send_response( 404 )
+      self.send_header( "Content-Length", "0" )
+      self.end_headers()
+      return
+    self.send_response( 200 )
+    self.send_header( "Content-Type", "text/html" )
+    self.send_header( "Content-Length", str( len(body) ) )
+    self.end_headers()
+    self.wfile.write( body )
+
+
+class CrawlerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = http.server.ThreadingHTTPServer( ("127.0.0.1", 0), Handler )
+    threading.Thread( target=self.server.serve_forever, daemon=True ).start()
+    self.base = "http://127.0.0.1:%d" % self.server.server_port
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def expected(self):
+    return [self.base, self.base + "/a", self.base + "/b?y=1&x=2"]
+
+  def test_crawl_skips_malformed_links(self):
+    f = Fetcher()
+    pages = f.crawl_domain( self.base, 3 )
+    f.close()
+    # Urls are stored as found, the seed as given
+    self.assertEqual( sorted( pages ), self.expected() )
+
+  def test_async_crawl_skips_malformed_links(self):
+    async def crawl():
+      f = AsyncFetcher()
+      try:
+        return await f.crawl_domain( self.base, 3 )
+      finally:
+        await f.close()
+    self.assertEqual( sorted( asyncio.run( crawl() ) ), self.expected() )
+
+  def test_replay_of_malformed_urls(self):
+    pool = ReplayPool( {"http://127.0.0.1:abc/x": b"bad", self.base + "/": b"home"} )
+    f = Fetcher( pool=pool )
+    self.assertEqual( f.fetch( self.base ), b"home" )
+    self.assertEqual( f.fetch( "http://127.0.0.1:abc/x" ), b"bad" )
+
+
+if __name__ == "__main__":
+  unittest.main()
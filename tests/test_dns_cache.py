@@ -0,0 +1,105 @@
+# -*- coding: utf8 -*-
+
+import socket, time, unittest
+
+from Pywemil.dns_cache import DNSCache
+
+__author__ = "glebourgeois@me.com"
+
+def wait_until(condition, timeout=5):
+  deadline = time.time() + timeout
+  while not condition() and time.time() < deadline:
+    time.sleep( 0.01 )
+  return condition()
+
+
+class StubResolver:
+  """
+  Stands in for socket.getaddrinfo : known hosts resolve to 127.0.0.1, others fail.
+  """
+
+  def __init__(self, hosts):
+    self.hosts = hosts
+    self.calls = []
+
+  def __call__(self, host, port, family=0, type=0):
+    self.calls.append( host )
+    if host not in self.hosts:
+      raise socket.gaierror( socket.EAI_NONAME, "Name or service not known" )
+    return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port))]
+
+
+class DNSCacheTest(unittest.TestCase):
+
+  def test_hit_and_miss(self):
+    resolver = StubResolver( set(["example.com"]) )
+    dns = DNSCache( resolver=resolver )
+    first = dns.resolve( "example.com", 80 )
+    self.assertEqual( first[0][4], ("127.0.0.1", 80) )
+    self.assertEqual( dns.resolve( "example.com", 80 ), first )
+    self.assertEqual( resolver.calls, ["example.com"] )
+    self.assertEqual( (dns.hits, dns.misses), (1, 1) )
+
+    # Entries are kept per port
+    dns.resolve( "example.com", 443 )
+    self.assertEqual( (dns.hits, dns.misses), (1, 2) )
+
+  def test_ttl(self):
+    resolver = StubResolver( set(["example.com"]) )
+    dns = DNSCache( ttl=0.05, resolver=resolver )
+    dns.resolve( "example.com", 80 )
+    time.sleep( 0.1 )
+    dns.resolve( "example.com", 80 )
+    self.assertEqual( len(resolver.calls), 2 )
+    self.assertEqual( dns.misses, 2 )
+
+  def test_negative_ttl(self):
+    resolver = StubResolver( set() )
+    dns = DNSCache( negative_ttl=0.1, resolver=resolver )
+    errors = []
+    for i in range(3):
+      with self.assertRaises( socket.gaierror ) as context:
+        dns.resolve( "missing.example", 80 )
+      errors.append( context.exception )
+    self.assertEqual( resolver.calls, ["missing.example"] )
+    self.assertEqual( (dns.hits, dns.misses, dns.failures), (2, 1, 1) )
+    # Each hit raises a new error, with the arguments of the original one
+    self.assertIsNot( errors[1], errors[2] )
+    self.assertEqual( errors[2].args, errors[0].args )
+
+    time.sleep( 0.15 )
+    resolver.hosts.add( "missing.example" )
+    self.assertEqual( dns.resolve( "missing.example", 80 )[0][4], ("127.0.0.1", 80) )
+    self.assertEqual( len(resolver.calls), 2 )
+
+  def test_prefetch(self):
+    resolver = StubResolver( set(["example.com"]) )
+    dns = DNSCache( resolver=resolver )
+    dns.prefetch( "example.com", 80 )
+    self.assertTrue( wait_until( lambda: ("example.com", 80) in dns._entries ) )
+    dns.resolve( "example.com", 80 )
+    self.assertEqual( resolver.calls, ["example.com"] )
+    self.assertEqual( dns.hits, 1 )
+
+    # Cached hosts are not resolved again, and a failed prefetch is not raised
+    dns.prefetch( "example.com", 80 )
+    dns.prefetch( "missing.example", 80 )
+    self.assertTrue( wait_until( lambda: ("missing.example", 80) in dns._entries ) )
+    self.assertEqual( resolver.calls, ["example.com", "missing.example"] )
+    dns.close()
+
+  def test_create_connection(self):
+    server = socket.socket()
+    server.bind( ("127.0.0.1", 0) )
+    server.listen( 1 )
+    try:
+      dns = DNSCache( resolver=StubResolver( set(["example.com"]) ) )
+      sock = dns.create_connection( ("example.com", server.getsockname()[1]), timeout=5 )
+      self.assertEqual( sock.getpeername(), server.getsockname() )
+      sock.close()
+    finally:
+      server.close()
+
+
+if __name__ == "__main__":
+  unittest.main()
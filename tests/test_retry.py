@@ -0,0 +1,74 @@
+# -*- coding: utf8 -*-
+
+import http.server, threading, unittest, urllib.error
+
+from Pywemil.fetcher import Fetcher
+from Pywemil.retry import RetryPolicy
+
+__author__ = "glebourgeois@me.com"
+
+class UnavailableHandler(http.server.BaseHTTPRequestHandler):
+  """
+  Answers 503 to every request, and counts requests by method.
+  """
+  protocol_version = "HTTP/1.1"
+  requests = None
+
+  def log_message(self, *args):
+    pass
+
+  def _answer(self, method):
+    self.requests[method] = self.requests.get( method, 0 ) + 1
+    length = int( self.headers.get("Content-Length") or 0 )
+    self.rfile.read( length )
+    self.send_response( 503 )
+    self.send_header( "Content-Length", "0" )
+    self.end_headers()
+
+  def do_GET(self):
+    self._answer( "GET" )
+
+  def do_POST(self):
+    self._answer( "POST" )
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+  def setUp(self):
+    UnavailableHandler.requests = {}
+    self.server = http.server.ThreadingHTTPServer( ("127.0.0.1", 0), UnavailableHandler )
+    threading.Thread( target=self.server.serve_forever, daemon=True ).start()
+    self.url = "http://127.0.0.1:%d/" % self.server.server_port
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_is_retryable(self):
+    error = urllib.error.HTTPError( self.url, 503, "Unavailable", None, None )
+    policy = RetryPolicy()
+    self.assertTrue( policy.is_retryable( error ) )
+    self.assertTrue( policy.is_retryable( error, "head" ) )
+    self.assertFalse( policy.is_retryable( error, "POST" ) )
+    self.assertFalse( policy.is_retryable( urllib.error.HTTPError( self.url, 404, "Not found", None, None ) ) )
+    self.assertTrue( RetryPolicy( methods=("GET", "POST") ).is_retryable( error, "POST" ) )
+
+  def test_get_is_retried(self):
+    f = Fetcher( retry=RetryPolicy( retries=3, backoff=0.01 ) )
+    self.assertIsNone( f.fetch( self.url ) )
+    self.assertEqual( UnavailableHandler.requests, {"GET": 4} )
+
+  def test_post_is_not_retried_by_default(self):
+    f = Fetcher( retry=RetryPolicy( retries=3, backoff=0.01 ) )
+    self.assertIsNone( f.fetch( self.url, data="a=1" ) )
+    self.assertEqual( UnavailableHandler.requests, {"POST": 1} )
+    self.assertEqual( f.get_last_error().code, 503 )
+
+  def test_post_retries_are_opt_in(self):
+    f = Fetcher( retry=RetryPolicy( retries=3, backoff=0.01, methods=("GET", "HEAD", "POST") ) )
+    self.assertIsNone( f.fetch( self.url, data="a=1" ) )
+    self.assertEqual( UnavailableHandler.requests, {"POST": 4} )
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,34 @@
+# -*- coding: utf8 -*-
+
+import unittest
+
+from Pywemil.urlnorm import canonicalize_url
+
+__author__ = "glebourgeois@me.com"
+
+class CanonicalizeUrlTest(unittest.TestCase):
+
+  def test_trivial_variants(self):
+    self.assertEqual( canonicalize_url( "HTTP://Example.COM:80" ), "http://example.com/" )
+    self.assertEqual( canonicalize_url( "https://example.com:443/a#top" ), "https://example.com/a" )
+    self.assertEqual( canonicalize_url( "http://example.com:8080/a%2fb" ), "http://example.com:8080/a%2Fb" )
+    self.assertEqual( canonicalize_url( "http://u:p@Example.com/" ), "http://u:p@example.com/" )
+
+  def test_query_keeps_its_meaning(self):
+    self.assertEqual( canonicalize_url( "http://h/?b=2&a=1" ), "http://h/?a=1&b=2" )
+    # Parameters sharing a name keep their order, and are not decoded
+    self.assertEqual( canonicalize_url( "http://h/?b=2&b=1" ), "http://h/?b=2&b=1" )
+    self.assertEqual( canonicalize_url( "http://h/?flag" ), "http://h/?flag" )
+    self.assertEqual( canonicalize_url( "http://h/?q=a/b" ), "http://h/?q=a/b" )
+
+  def test_ipv6(self):
+    self.assertEqual( canonicalize_url( "http://[::1]:8080/x" ), "http://[::1]:8080/x" )
+    self.assertEqual( canonicalize_url( "http://[::1]:80/x" ), "http://[::1]/x" )
+
+  def test_malformed_urls_are_unchanged(self):
+    for url in ["http://host:abc/", "http://host:99999/x", "http://[::1/x"]:
+      self.assertEqual( canonicalize_url( url ), url )
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,49 @@
+# -*- coding: utf8 -*-
+
+import re, urllib.parse
+
+__author__ = "glebourgeois@me.com"
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+__escape_re = re.compile("%[0-9a-fA-F]{2}")
+
+def canonicalize_url(url):
+  """
+  Returns a canonical form of url, so that trivial variants of a same url are equal :
+
+    - scheme and host are lower cased, default ports are removed
+    - fragment is removed
+    - an empty path becomes /
+    - query parameters are sorted by name (parameters sharing a name keep their order)
+    - percent escapes are upper cased
+
+  Parameters are not decoded, so that the canonical url still requests the same resource.
+  A malformed url (invalid port or IPv6 address) is returned unchanged.
+  """
+  try:
+    parts = urllib.parse.urlsplit( url.strip() )
+    port = parts.port
+  except ValueError:
+    return url
+  scheme = parts.scheme.lower()
+
+  netloc = (parts.hostname or "").lower()
+  if ":" in netloc:
+    # IPv6 address
+    netloc = "[%s]" % netloc
+  if port is not None and port != DEFAULT_PORTS.get( scheme ):
+    netloc = "%s:%d" % (netloc, port)
+  if parts.username is not None:
+    userinfo = parts.username
+    if parts.password is not None:
+      userinfo += ":" + parts.password
+    netloc = userinfo + "@" + netloc
+
+  path = __escape_re.sub( lambda m: m.group(0).upper(), parts.path ) or "/"
+
+  params = [p for p in parts.query.split("&") if p]
+  params.sort( key=lambda p: p.split("=", 1)[0] )
+  query = __escape_re.sub( lambda m: m.group(0).upper(), "&".join( params ) )
+
+  return urllib.parse.urlunsplit( (scheme, netloc, path, query, "") )
@@ -0,0 +1,269 @@
+# -*- coding: utf8 -*-
+
+import base64, datetime, gzip, hashlib, os, threading, urllib.parse, uuid, zlib
+
+__author__ = "glebourgeois@me.com"
+
+# Headers describing how the body was transferred : bodies are archived decoded
+DROPPED_HEADERS = set( ["content-encoding", "transfer-encoding", "content-length"] )
+
+def _warc_date(timestamp=None):
+  if timestamp is None:
+    timestamp = datetime.datetime.now( datetime.timezone.utc )
+  return timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _cdx_date():
+  return datetime.datetime.now( datetime.timezone.utc ).strftime("%Y%m%d%H%M%S")
+
+def _digest(data):
+  return "sha1:" + base64.b32encode( hashlib.sha1( data ).digest() ).decode("ascii")
+
+def _record(warc_type, url, block, content_type, extra=None):
+  """
+  Returns a whole WARC record (headers, block and trailing lines) as bytes.
+  """
+  headers = [
+    ("WARC-Type", warc_type),
+    ("WARC-Record-ID", "<urn:uuid:%s>" % uuid.uuid4()),
+    ("WARC-Date", _warc_date()),
+  ]
+  if url is not None:
+    headers.append( ("WARC-Target-URI", url) )
+  headers += extra or []
+  headers += [
+    ("Content-Type", content_type),
+    ("Content-Length", str( len(block) )),
+  ]
+  head = "WARC/1.0\r\n" + "".join( "%s: %s\r\n" % h for h in headers ) + "\r\n"
+  return head.encode("utf-8") + block + b"\r\n\r\n"
+
+def _parse_headers(lines):
+  headers = []
+  for line in lines:
+    if b":" in line:
+      name, value = line.split(b":", 1)
+      headers.append( (name.decode("latin-1").strip(), value.decode("latin-1").strip()) )
+  return headers
+
+def parse_record(data):
+  """
+  Parses a WARC record given as uncompressed bytes.
+  Returns (warc headers, http status, http headers, body) : for response records,
+  the HTTP head is split from the body, else status is None and http headers are empty.
+  """
+  head, block = data.split(b"\r\n\r\n", 1)
+  warc_headers = dict( _parse_headers( head.split(b"\r\n")[1:] ) )
+  block = block[:int( warc_headers.get("Content-Length", len(block)) )]
+
+  status = None
+  http_headers = []
+  if warc_headers.get("WARC-Type") == "response" and block.startswith(b"HTTP/"):
+    http_head, block = block.split(b"\r\n\r\n", 1)
+    lines = http_head.split(b"\r\n")
+    status = int( lines[0].split()[1] )
+    http_headers = _parse_headers( lines[1:] )
+  return (warc_headers, status, http_headers, block)
+
+def iter_records(path):
+  """
+  Yields (offset, record) of each record of a gzip-per-record WARC file, record being
+  parsed by parse_record. The file is read sequentially, one record at a time.
+  """
+  with open(path, "rb") as f:
+    offset = 0
+    pending = b""
+    decompressor = zlib.decompressobj( 16 + zlib.MAX_WBITS )
+    data = []
+    while True:
+      chunk = pending or f.read( 65536 )
+      pending = b""
+      if not chunk:
+        break
+      data.append( decompressor.decompress( chunk ) )
+      if decompressor.eof:
+        # End of a gzip member, thus of a record
+        pending = decompressor.unused_data
+        yield (offset, parse_record( b"".join( data ) ))
+        offset = f.tell() - len(pending)
+        decompressor = zlib.decompressobj( 16 + zlib.MAX_WBITS )
+        data = []
+
+
+class WARCWriter:
+  """
+  Dictionary-like store of crawled pages (url -> html code), appending each page to
+  WARC files (one gzip member per record, so that any record can be read alone).
+  When a file is larger than max_size, a new one is started.
+  With write_response, request and response headers are archived along the body.
+  An index file (CDX-like) gives the file, offset and length of each record.
+  """
+
+  def __init__(self, directory, prefix="crawl", max_size=1024 * 1024 * 1024):
+    """
+    :param directory: Directory where WARC files are written, created if needed
+    :param prefix: Prefix of WARC file names (prefix-00000.warc.gz, prefix-00001.warc.gz, ...)
+    :param max_size: Size in bytes after which a new WARC file is started
+    """
+    self.directory = directory
+    self.prefix = prefix
+    self.max_size = max_size
+    self._lock = threading.Lock()
+    os.makedirs( directory, exist_ok=True )
+
+    # New files are started after existing ones, so that a crawl may be resumed
+    self._number = 0
+    while os.path.exists( self._path( self._number ) ):
+      self._number += 1
+    self._file = None
+    self._count = 0
+    self._index = open( os.path.join(directory, "%s.cdx" % prefix), "a", encoding="utf-8" )
+
+  def _path(self, number):
+    return os.path.join( self.directory, "%s-%05d.warc.gz" % (self.prefix, number) )
+
+  def _rotate(self):
+    # Called before each exchange, so that its request and response records stay in the same file
+    if self._file is not None and self._file.tell() >= self.max_size:
+      self._file.close()
+      self._file = None
+      self._number += 1
+    if self._file is None:
+      self._file = open( self._path( self._number ), "ab" )
+      info = ("software: Pywemil\r\nformat: WARC File Format 1.0\r\n").encode("utf-8")
+      self._file.write( gzip.compress( _record( "warcinfo", None, info, "application/warc-fields" ) ) )
+
+  def _append(self, record):
+    """
+    Writes record as a gzip member, and returns (file name, offset, length).
+    """
+    data = gzip.compress( record )
+    offset = self._file.tell()
+    self._file.write( data )
+    return (os.path.basename( self._file.name ), offset, len(data))
+
+  def write_response(self, url, body, response=None):
+    """
+    Archives body fetched from url. response, if given, is the connection_pool.PooledResponse
+    it was read from (see fetcher.Fetcher.get_last_response) : a request record, and
+    a response record with the status and headers of the server, are written.
+    Bodies are archived decoded, so that Content-Encoding and Transfer-Encoding headers are dropped.
+    """
+    status, reason, headers = 200, "OK", []
+    method, request_headers = "GET", {}
+    if response is not None:
+      status, reason = response.status, response.reason
+      headers = list( response.headers.items() )
+      method, request_headers = response.method, response.request_headers
+
+    mime = "text/html"
+    head = "HTTP/1.1 %d %s\r\n" % (status, reason)
+    for name, value in headers:
+      if name.lower() == "content-type":
+        mime = value.split(";")[0].strip()
+      if name.lower() not in DROPPED_HEADERS:
+        head += "%s: %s\r\n" % (name, value)
+    head += "Content-Length: %d\r\n\r\n" % len(body)
+    block = head.encode("latin-1", "replace") + body
+    digest = _digest( body )
+    extra = [("WARC-Payload-Digest", digest)]
+
+    with self._lock:
+      self._rotate()
+      if response is not None:
+        parts = urllib.parse.urlsplit( url )
+        path = parts.path or "/"
+        if parts.query:
+          path += "?" + parts.query
+        request = "%s %s HTTP/1.1\r\nHost: %s\r\n" % (method, path, parts.netloc)
+        request += "".join( "%s: %s\r\n" % h for h in request_headers.items() ) + "\r\n"
+        self._append( _record( "request", url, request.encode("latin-1", "replace"), "application/http; msgtype=request" ) )
+
+      filename, offset, length = self._append( _record( "response", url, block, "application/http; msgtype=response", extra ) )
+      # CDX fields : url, timestamp, mime type, status, digest, compressed length, offset, file
+      self._index.write( "%s %s %s %d %s %d %d %s\n" % (url.replace(" ", "%20"), _cdx_date(), mime, status, digest, length, offset, filename) )
+      self._index.flush()
+      self._count += 1
+
+  def __setitem__(self, url, html):
+    self.write_response( url, html )
+
+  def __len__(self):
+    return self._count
+
+  def close(self):
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+        self._file = None
+      self._index.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+class WARCReader:
+  """
+  Random access to pages archived by a WARCWriter : the index file gives the location
+  of each record, which is read and decompressed alone.
+  It is dictionary-like (url -> html code), like page_store.PageStore.
+  """
+
+  def __init__(self, directory, prefix="crawl"):
+    """
+    :param directory: Directory of WARC files
+    :param prefix: Prefix of WARC file names
+    """
+    self.directory = directory
+    self.prefix = prefix
+
+    self._offsets = {} # url -> (file name, offset, length), the last record of an url wins
+    path = os.path.join( directory, "%s.cdx" % prefix )
+    if os.path.exists( path ):
+      with open(path, encoding="utf-8") as f:
+        for line in f:
+          fields = line.split()
+          if len(fields) == 8:
+            self._offsets[fields[0].replace("%20", " ")] = (fields[7], int( fields[6] ), int( fields[5] ))
+
+  def record(self, url):
+    """
+    Returns the record archived for url, as parse_record does : (warc headers, status, http headers, body).
+    """
+    try:
+      filename, offset, length = self._offsets[url]
+    except KeyError:
+      raise KeyError( url )
+    with open(os.path.join( self.directory, filename ), "rb") as f:
+      f.seek( offset )
+      return parse_record( gzip.decompress( f.read( length ) ) )
+
+  def __getitem__(self, url):
+    return self.record( url )[3]
+
+  def get(self, url, default=None):
+    try:
+      return self[url]
+    except KeyError:
+      return default
+
+  def __contains__(self, url):
+    return url in self._offsets
+
+  def __iter__(self):
+    return iter( self._offsets )
+
+  def keys(self):
+    return iter( self )
+
+  def items(self):
+    """
+    Yields (url, html) tuples, reading records one at a time.
+    """
+    for url in self:
+      yield (url, self[url])
+
+  def __len__(self):
+    return len( self._offsets )